@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_CACHES = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Response versions, project membership and timesheets are cached in the
+    default cache and invalidated by whichever web or Celery process writes.
+    A per-process cache would keep serving stale data in the others.
+    """
+    if settings.CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Error(
+            "The default cache is not shared between processes.",
+            hint="Set CACHE_URL to the Redis service, e.g. redis://redis:6379/1.",
+            id="core.E001",
+        )
+    ]
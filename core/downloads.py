@@ -0,0 +1,121 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import quote_etag
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(field_file) -> str:
+    storage = field_file.storage
+    modified = storage.get_modified_time(field_file.name).timestamp()
+    size = storage.size(field_file.name)
+    digest = hashlib.sha1(f"{field_file.name}:{size}:{modified}".encode("utf-8"))
+    return quote_etag(digest.hexdigest())
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _parse_range(header: str, size: int):
+    """
+    The (start, end) of a single-range `Range` header, inclusive.
+
+    Returns None for headers that should be ignored (multiple ranges or a
+    unit other than bytes) and raises ValueError for unsatisfiable ranges.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+def _read_range(field_file, start: int, length: int):
+    with field_file.open("rb") as source:
+        source.seek(start)
+        while length > 0:
+            chunk = source.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, field_file, *, filename, content_type):
+    """
+    Respond with a stored file, honouring conditional and range requests.
+
+    With `SENDFILE_BACKEND` set to "x-accel-redirect" or "x-sendfile", the
+    response only carries a header telling the web server which file to
+    send, and the web server does the byte transfer (including ranges).
+    Otherwise the file is streamed from Django in chunks.
+    """
+    etag = file_etag(field_file)
+    disposition = f'attachment; filename="{filename}"'
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        response = HttpResponse(status=304)
+        response["ETag"] = etag
+        return response
+
+    backend = getattr(settings, "SENDFILE_BACKEND", None)
+    if backend:
+        response = HttpResponse(content_type=content_type)
+        if backend == "x-accel-redirect":
+            prefix = settings.SENDFILE_URL_PREFIX.rstrip("/")
+            response["X-Accel-Redirect"] = f"{prefix}/{field_file.name}"
+        else:
+            response["X-Sendfile"] = field_file.path
+        response["Content-Disposition"] = disposition
+        response["ETag"] = etag
+        return response
+
+    size = field_file.storage.size(field_file.name)
+    byte_range = None
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and (not if_range or if_range == etag):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    if byte_range is None:
+        response = FileResponse(
+            field_file.open("rb"),
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type,
+        )
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _read_range(field_file, start, length),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Length"] = str(length)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Disposition"] = disposition
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    return response
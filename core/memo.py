@@ -0,0 +1,46 @@
+"""
+Request- and task-scoped memoization.
+
+Code that resolves the same value many times while serving one request or
+running one task can keep it in `scoped_memo(namespace)`. The memo is
+empty at the start of every request (MemoScopeMiddleware) and every Celery
+task, and outside of a scope `scoped_memo` returns None.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_memo = ContextVar("memo", default=None)
+
+
+def begin_memo_scope():
+    return _memo.set({})
+
+
+def end_memo_scope(token):
+    _memo.reset(token)
+
+
+@contextmanager
+def memo_scope():
+    token = begin_memo_scope()
+    try:
+        yield
+    finally:
+        end_memo_scope(token)
+
+
+def scoped_memo(namespace):
+    memo = _memo.get()
+    if memo is None:
+        return None
+    return memo.setdefault(namespace, {})
+
+
+class MemoScopeMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with memo_scope():
+            return self.get_response(request)
@@ -1,7 +1,131 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination,
+    PageNumberPagination,
+    _positive_int,
+)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only keyset pagination on the view's `keyset_ordering`.
+
+    The ordering is a tuple of fields sorted the same way and ending in a
+    unique one, e.g. ("-date_logged", "-id"), ideally backed by a composite
+    index. A page is the rows after the cursor, which encodes the ordering
+    values of the previous page's last row, so every page costs the same
+    index range scan and no COUNT query is run.
+    """
+
+    cursor_query_param = "cursor"
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = view.keyset_ordering
+        self.fields = [field.lstrip("-") for field in self.ordering]
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self._after(queryset.model, cursor))
+        rows = list(queryset[: page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def _after(self, model, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if len(values) != len(self.fields):
+                raise ValueError
+            values = [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (ValueError, TypeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        lookup = "lt" if self.ordering[0].startswith("-") else "gt"
+        after = Q()
+        equal = Q()
+        for field, value in zip(self.fields, values):
+            after |= equal & Q(**{f"{field}__{lookup}": value})
+            equal &= Q(**{field: value})
+        return after
+
+    def encode_cursor(self, row):
+        values = [getattr(row, field) for field in self.fields]
+        payload = DjangoJSONEncoder().encode(values).encode("utf-8")
+        return base64.urlsafe_b64encode(payload).decode("ascii")
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1]),
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
 
 
 class DefaultPagination(PageNumberPagination):
+    """
+    Page-number pagination, or keyset pagination when the request passes
+    `?cursor=` (empty for the first page) to a view with `keyset_ordering`.
+    """
+
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 100
+
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            getattr(view, "keyset_ordering", None)
+            and KeysetPagination.cursor_query_param in request.query_params
+        ):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
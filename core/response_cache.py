@@ -0,0 +1,199 @@
+"""
+Model versions, response caching and conditional GETs for DRF viewsets.
+
+Every model a versioned viewset depends on (its queryset's model plus
+`cache_models`) has a version token in the Django cache. The models are
+registered with `register_versioned_models` from `AppConfig.ready()`, so
+every process that writes them (web, Celery, shell) replaces their tokens
+on save, delete and many-to-many changes; writes that bypass model signals,
+such as queryset updates, call `invalidate_model` themselves. A token records when it was
+issued, which gives the Last-Modified time of everything built from it.
+Last-Modified has a resolution of one second, so it is only sent once the
+second of the newest token has passed; until then a later write could share
+it and If-Modified-Since would miss that write.
+
+`CachedListMixin` stores list responses keyed on the viewset, the user's
+role and id, the normalized query params and the versions.
+`ConditionalGetMixin` derives an ETag from the same inputs and answers
+`If-None-Match`/`If-Modified-Since` with 304 before touching the database.
+"""
+
+import hashlib
+import json
+import time
+import uuid
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.downloads import etag_matches
+
+RESPONSE_CACHE_TIMEOUT = 5 * 60
+
+_versioned_labels = set()
+
+
+def _version_key(label):
+    return f"response-cache-version:{label}"
+
+
+def _new_version():
+    return f"{time.time():.6f}:{uuid.uuid4().hex}"
+
+
+def _model_versions(labels):
+    keys = [_version_key(label) for label in labels]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def register_versioned_models(*models):
+    """
+    Version `models` for versioned views. Call from `AppConfig.ready()`.
+    """
+    _versioned_labels.update(model._meta.label_lower for model in models)
+
+
+def invalidate_model(model):
+    key = _version_key(model._meta.label_lower)
+
+    def bump():
+        cache.set(key, _new_version(), None)
+
+    bump()
+    # A concurrent reader may cache a response built before this commits.
+    transaction.on_commit(bump)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_saved_model(sender, **kwargs):
+    if sender._meta.label_lower in _versioned_labels:
+        invalidate_model(sender)
+
+
+@receiver(m2m_changed)
+def invalidate_changed_relation(sender, action, **kwargs):
+    if action.startswith("post_") and sender._meta.label_lower in _versioned_labels:
+        invalidate_model(sender)
+
+
+class VersionedViewMixin:
+    cache_models = ()
+
+    def get_cache_models(self):
+        models = list(self.cache_models)
+        if getattr(self, "queryset", None) is not None:
+            models.insert(0, self.queryset.model)
+        return models
+
+    def get_model_versions(self):
+        if not hasattr(self, "_model_versions"):
+            labels = sorted(
+                {model._meta.label_lower for model in self.get_cache_models()}
+            )
+            unregistered = set(labels) - _versioned_labels
+            if unregistered:
+                raise ImproperlyConfigured(
+                    f"{', '.join(sorted(unregistered))} must be registered with "
+                    "register_versioned_models()"
+                )
+            # A token issued after this read is at least this recent.
+            self._versions_read_at = time.time()
+            self._model_versions = _model_versions(labels)
+        return self._model_versions
+
+    def get_version_digest(self, request):
+        """
+        Digest of everything a GET response of this view is built from.
+        """
+        params = sorted(
+            (name, sorted(request.query_params.getlist(name)))
+            for name in request.query_params
+        )
+        payload = [
+            self.get_model_versions(),
+            self.action,
+            self.kwargs,
+            params,
+            request.user.role,
+            request.user.pk,
+        ]
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def get_last_modified(self):
+        """
+        Second of the newest version, or None while that second is current.
+        """
+        versions = self.get_model_versions()
+        newest = int(max(float(version.split(":")[0]) for version in versions))
+        if newest >= int(self._versions_read_at):
+            return None
+        return newest
+
+
+class CachedListMixin(VersionedViewMixin):
+    cache_timeout = RESPONSE_CACHE_TIMEOUT
+
+    def list(self, request, *args, **kwargs):
+        key = f"response:{self.basename}:{self.get_version_digest(request)}"
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.cache_timeout)
+        return response
+
+
+class ConditionalGetMixin(VersionedViewMixin):
+    def _not_modified(self, request, etag, last_modified):
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if last_modified is None:
+            return False
+        if_modified_since = parse_http_date_safe(
+            request.headers.get("If-Modified-Since", "")
+        )
+        return if_modified_since is not None and last_modified <= if_modified_since
+
+    def conditional_response(self, request, render):
+        etag = quote_etag(self.get_version_digest(request))
+        last_modified = self.get_last_modified()
+        if self._not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = render()
+            if response.status_code != 200:
+                return response
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        # Look the object up first so that scoping and object permissions
+        # apply to conditional requests too; only serialization is skipped.
+        instance = self.get_object()
+        return self.conditional_response(
+            request, lambda: Response(self.get_serializer(instance).data)
+        )
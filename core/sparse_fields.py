@@ -0,0 +1,157 @@
+"""
+Sparse fieldsets and inline expansion for DRF model serializers.
+
+`?fields=id,title` limits a response to the listed fields and
+`?expand=client,developers` inlines related objects in place of their ids,
+using the serializers named in the serializer's `Meta.expandable_fields`:
+
+    class ProjectSerializer(SparseFieldsSerializerMixin, ModelSerializer):
+        class Meta:
+            model = Project
+            fields = "__all__"
+            expandable_fields = {
+                "client": "app.serializers.MemberSerializer",
+                "developers": ("app.serializers.MemberSerializer", {"many": True}),
+            }
+
+An expanded field is included even when `?fields=` leaves it out.
+
+`SparseFieldsViewMixin` passes both params to the serializer on list and
+retrieve and plans the queryset from the fields it will read: `.only()` the
+selected columns, `select_related` for expanded forward relations and
+`prefetch_related` for to-many relations, so a page costs the same number
+of queries however many rows or expansions it has. On a versioned view
+(core.response_cache), `expand_cache_models` names the extra models each
+expansion depends on, so they only version the responses that inline them.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import BaseSerializer
+
+
+def _names(value):
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+class SparseFieldsSerializerMixin:
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requested_fields = fields
+        self.expand = expand
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expandable = getattr(self.Meta, "expandable_fields", {})
+
+        unknown = set(self.expand) - set(expandable)
+        if unknown:
+            raise ValidationError(
+                {"expand": f"Cannot expand {', '.join(sorted(unknown))}"}
+            )
+        if self.requested_fields is not None:
+            unknown = set(self.requested_fields) - set(fields) - set(expandable)
+            if unknown:
+                raise ValidationError(
+                    {"fields": f"Unknown fields {', '.join(sorted(unknown))}"}
+                )
+            fields = {
+                name: field
+                for name, field in fields.items()
+                if name in self.requested_fields
+            }
+
+        for name in self.expand:
+            serializer_class, options = expandable[name], {}
+            if isinstance(serializer_class, tuple):
+                serializer_class, options = serializer_class
+            if isinstance(serializer_class, str):
+                serializer_class = import_string(serializer_class)
+            fields[name] = serializer_class(read_only=True, **options)
+        return fields
+
+
+def _plan(model, fields, required=(), prefix=""):
+    """
+    Columns, select_related and prefetch_related lookups that serializing
+    `fields` of `model` rows reads. Columns is None when they are unknown.
+    """
+    columns = {model._meta.pk.name, *required}
+    select, prefetch = [], []
+    for field in fields.values():
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            # A property or method may read any column.
+            columns = None
+            continue
+        nested = getattr(field, "child", field)
+        nested_fields = nested.fields if isinstance(nested, BaseSerializer) else {}
+        lookup = prefix + field.source
+
+        if model_field.many_to_many or model_field.one_to_many:
+            # A reverse foreign key is matched to its rows on the remote column.
+            remote = [model_field.field.name] if model_field.one_to_many else []
+            related = plan_queryset(
+                model_field.related_model._default_manager.all(),
+                nested_fields,
+                remote,
+            )
+            prefetch.append(Prefetch(lookup, queryset=related))
+            continue
+
+        if columns is not None:
+            columns.add(field.source)
+        if model_field.is_relation and nested_fields:
+            _, nested_select, nested_prefetch = _plan(
+                model_field.related_model, nested_fields, prefix=f"{lookup}__"
+            )
+            select += [lookup, *nested_select]
+            prefetch += nested_prefetch
+    return columns, select, prefetch
+
+
+def plan_queryset(queryset, fields, required=()):
+    """
+    Restrict `queryset` to what serializing `fields` reads and load the
+    relations they follow in a fixed number of queries.
+    """
+    columns, select, prefetch = _plan(queryset.model, fields, required)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if columns is not None:
+        queryset = queryset.only(*columns)
+    return queryset
+
+
+class SparseFieldsViewMixin:
+    sparse_actions = ("list", "retrieve")
+    expand_cache_models = {}
+
+    def get_expand(self):
+        return _names(self.request.query_params.get("expand", ""))
+
+    def get_cache_models(self):
+        models = super().get_cache_models()
+        if self.action in self.sparse_actions:
+            for name in self.get_expand():
+                models += self.expand_cache_models.get(name, [])
+        return models
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in self.sparse_actions:
+            params = self.request.query_params
+            if "fields" in params:
+                kwargs.setdefault("fields", _names(params["fields"]))
+            kwargs.setdefault("expand", self.get_expand())
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.sparse_actions:
+            queryset = plan_queryset(queryset, self.get_serializer().fields)
+        return queryset
@@ -1,5 +1,8 @@
 import os
 from celery import Celery
+from celery.signals import task_postrun, task_prerun
+
+from core.memo import begin_memo_scope, end_memo_scope
 
 # Set the default Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'internal_ops.settings')
@@ -11,4 +14,19 @@ app = Celery('internal_ops')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Auto-discover tasks in all registered Django apps
-app.autodiscover_tasks() 
\ No newline at end of file
+app.autodiscover_tasks()
+
+# Give every task its own request-style memo (see core.memo).
+_memo_tokens = {}
+
+
+@task_prerun.connect
+def open_memo_scope(task_id=None, **kwargs):
+    _memo_tokens[task_id] = begin_memo_scope()
+
+
+@task_postrun.connect
+def close_memo_scope(task_id=None, **kwargs):
+    token = _memo_tokens.pop(task_id, None)
+    if token is not None:
+        end_memo_scope(token)
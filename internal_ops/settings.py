@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -62,6 +63,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "simple_history.middleware.HistoryRequestMiddleware",
+    "core.memo.MemoScopeMiddleware",
 ]
 
 ROOT_URLCONF = "internal_ops.urls"
@@ -99,6 +101,26 @@ DATABASES = {
 }
 
 
+# Cache
+# Shared by every web and worker process when CACHE_URL points at Redis
+# (e.g. redis://redis:6379/1); falls back to a per-process memory cache for
+# tests and single-process development, which `check --deploy` rejects.
+
+if os.environ.get("CACHE_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["CACHE_URL"],
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -139,6 +161,13 @@ STATIC_URL = "static/"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Protected downloads (e.g. invoice PDFs) are handed off to the web server
+# with "x-accel-redirect" (nginx, under an internal location mapped to
+# SENDFILE_URL_PREFIX) or "x-sendfile" (Apache/lighttpd). With None, Django
+# streams the file itself.
+SENDFILE_BACKEND = None
+SENDFILE_URL_PREFIX = "/protected-media/"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -153,6 +182,40 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "UTC"
+# Invoice rendering tasks are long and uneven, so hand them out one at a time
+# per worker process and only acknowledge them once they are done. This keeps
+# every core busy during a billing run instead of queueing work behind a
+# single slow client.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+
+# Invoice PDF rendering. Every document is a pdfkit/wkhtmltopdf invocation
+# until a long-lived renderer speaking the framing described in
+# project_management.rendering is deployed; then switch to the pool:
+#
+#     PDF_RENDERER = {
+#         "BACKEND": "project_management.rendering.PooledRenderer",
+#         "OPTIONS": {
+#             "command": ["/path/to/renderer"],
+#             "size": 4,
+#             "max_documents": 200,
+#             "max_rss_mb": 512,
+#             "timeout": 60,
+#         },
+#     }
+PDF_RENDERER = {
+    "BACKEND": "project_management.rendering.PdfkitRenderer",
+}
+
+# Invoices with more line items than this are rendered in chunks of
+# INVOICE_STREAMING_CHUNK_SIZE line items through a temporary file, which
+# keeps worker memory flat for very large billing periods.
+INVOICE_STREAMING_THRESHOLD = 1000
+INVOICE_STREAMING_CHUNK_SIZE = 500
+
+# Repeated invoice requests for the same admin, client and period within this
+# many seconds return the job that is already queued instead of a new one.
+INVOICE_JOB_IDEMPOTENCY_WINDOW = 10 * 60
 
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "core.paginations.DefaultPagination",
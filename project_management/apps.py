@@ -4,3 +4,25 @@ from django.apps import AppConfig
 class ProjectManagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'project_management'
+
+    def ready(self):
+        from core import checks  # noqa: F401
+        from core.response_cache import register_versioned_models
+        from project_management import signals  # noqa: F401
+        from project_management.models import (
+            Feature,
+            Function,
+            Invoice,
+            Project,
+            WorkLog,
+        )
+
+        # Everything the versioned viewsets depend on (see core.response_cache).
+        register_versioned_models(
+            Project,
+            Project.developers.through,
+            Feature,
+            Function,
+            WorkLog,
+            Invoice,
+        )
@@ -0,0 +1,132 @@
+"""
+Worker-lifetime registry of invoice rendering assets.
+
+The compiled invoice templates and the base64-encoded static assets they
+embed are loaded once per worker process. Later renders reuse them without
+touching the filesystem; the source files' mtimes are re-checked at most
+every `check_interval` seconds and the registry reloads when one changed.
+
+Templates are compiled from the sources read at load time by an engine of
+their own, including the partials they include. Django's cached template
+loader never reloads in workers and would keep serving the old ones.
+"""
+
+import base64
+import hashlib
+import os
+import threading
+import time
+from functools import lru_cache
+
+from django.contrib.staticfiles import finders
+from django.template import Context, Engine
+
+INVOICE_TEMPLATE = "invoices/invoice.html"
+
+# Partials of INVOICE_TEMPLATE, rendered separately when streaming.
+INVOICE_HEAD_TEMPLATE = "invoices/_invoice_head.html"
+INVOICE_ITEMS_TEMPLATE = "invoices/_invoice_items.html"
+INVOICE_FOOT_TEMPLATE = "invoices/_invoice_foot.html"
+
+INVOICE_TEMPLATES = [
+    INVOICE_TEMPLATE,
+    INVOICE_HEAD_TEMPLATE,
+    INVOICE_ITEMS_TEMPLATE,
+    INVOICE_FOOT_TEMPLATE,
+]
+
+# Context variable -> static file embedded into the invoice template.
+INVOICE_STATIC_ASSETS = {
+    "logo_base64": "images/logo.png",
+}
+
+CHECK_INTERVAL = 60
+
+
+class RenderAssets:
+    def __init__(self, template_names, static_assets, check_interval=CHECK_INTERVAL):
+        self.template_names = template_names
+        self.static_assets = static_assets
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._mtimes = {}
+        self.templates = {}
+        self.context = {}
+        self.version = ""
+
+    def load(self) -> "RenderAssets":
+        default = Engine.get_default()
+        sources = {}
+        digest = hashlib.sha256()
+        paths = []
+        for name in self.template_names:
+            path = default.find_template(name)[1].name
+            with open(path, encoding=default.file_charset) as template_file:
+                sources[name] = template_file.read()
+            digest.update(sources[name].encode("utf-8"))
+            paths.append(path)
+
+        engine = Engine(
+            loaders=[
+                (
+                    "django.template.loaders.cached.Loader",
+                    [("django.template.loaders.locmem.Loader", sources)],
+                )
+            ],
+            libraries=default.libraries,
+            autoescape=default.autoescape,
+            string_if_invalid=default.string_if_invalid,
+        )
+        templates = {name: engine.get_template(name) for name in sources}
+
+        context = {}
+        for name, static_path in sorted(self.static_assets.items()):
+            path = finders.find(static_path)
+            if not path:
+                context[name] = ""
+                continue
+            with open(path, "rb") as asset_file:
+                content = asset_file.read()
+            digest.update(content)
+            context[name] = base64.b64encode(content).decode("utf-8")
+            paths.append(path)
+
+        self.templates = templates
+        self.context = context
+        self.version = digest.hexdigest()
+        self._mtimes = {path: self._mtime(path) for path in paths}
+        self._checked_at = time.monotonic()
+        return self
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _is_stale(self) -> bool:
+        return any(self._mtime(path) != mtime for path, mtime in self._mtimes.items())
+
+    def current(self) -> "RenderAssets":
+        """
+        The loaded assets, reloading them if a source file changed.
+        """
+        with self._lock:
+            if self._checked_at is None:
+                return self.load()
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._checked_at = time.monotonic()
+                if self._is_stale():
+                    return self.load()
+            return self
+
+    def render(self, template_name: str, context: dict) -> str:
+        return self.templates[template_name].render(
+            Context({**self.context, **context})
+        )
+
+
+@lru_cache(maxsize=None)
+def invoice_assets() -> RenderAssets:
+    return RenderAssets(INVOICE_TEMPLATES, INVOICE_STATIC_ASSETS)
@@ -0,0 +1,211 @@
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import (
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    FilteredRelation,
+    Q,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce, Concat, NullIf, Trim
+from django.utils import timezone
+
+from core.response_cache import invalidate_model
+from project_management.models import Invoice, WorkLog
+from project_management.timesheets import invalidate_timesheets
+
+LINE_ITEM_CHUNK_SIZE = 2000
+
+# First key of the two-key PostgreSQL advisory lock taken while billing a
+# client; the second key is the client id.
+BILLING_LOCK_NAMESPACE = 7301
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def billable_worklogs(*, client_id, start_date, end_date):
+    """
+    Unbilled worklogs of a client's projects logged within the period.
+    """
+    return WorkLog.objects.filter(
+        billed_status=WorkLog.BillingStatus.UNBILLED,
+        date_logged__range=(start_date, end_date),
+        function__feature__project__client_id=client_id,
+    )
+
+
+def with_rates(worklogs):
+    """
+    Annotate each worklog with the developer's project rate and the line cost.
+
+    The rate comes from a single LEFT JOIN on ProjectRate matched on both the
+    worklog's project and developer; a missing rate prices the work at 0, the
+    same as `get_developer_rate`.
+    """
+    return worklogs.annotate(
+        project_rate=FilteredRelation(
+            "function__feature__project__rates",
+            condition=Q(function__feature__project__rates__developer=F("developer")),
+        ),
+        per_hour=Coalesce(
+            F("project_rate__rate"), Value(Decimal("0")), output_field=MONEY
+        ),
+    ).annotate(
+        cost=ExpressionWrapper(F("hours_worked") * F("per_hour"), output_field=MONEY),
+    )
+
+
+def _developer_name():
+    full_name = Trim(
+        Concat("developer__first_name", Value(" "), "developer__last_name")
+    )
+    return Coalesce(NullIf(full_name, Value("")), "developer__username")
+
+
+def line_items(worklogs, *, detail=False):
+    """
+    Priced invoice line items for `worklogs`, computed in the database.
+
+    By default there is one row per (project, developer) with the summed
+    hours and cost. With `detail=True` every worklog is its own line item.
+    """
+    priced = with_rates(worklogs)
+    if detail:
+        return priced.values(
+            "id",
+            "date_logged",
+            "developer_id",
+            "per_hour",
+            "cost",
+            project_id=F("function__feature__project_id"),
+            project_title=F("function__feature__project__title"),
+            developer_name=_developer_name(),
+            function_title=F("function__title"),
+            function_description=F("function__description"),
+            hours=F("hours_worked"),
+        ).order_by("project_title", "date_logged", "id")
+
+    return (
+        priced.values(
+            "developer_id",
+            "per_hour",
+            project_id=F("function__feature__project_id"),
+            project_title=F("function__feature__project__title"),
+            developer_name=_developer_name(),
+        )
+        .annotate(
+            hours=Sum("hours_worked"),
+            cost=Sum("cost", output_field=MONEY),
+        )
+        .order_by("project_title", "developer_name")
+    )
+
+
+def iter_line_items(worklogs, *, detail=False, chunk_size=LINE_ITEM_CHUNK_SIZE):
+    """
+    Stream line items through a server-side cursor instead of loading them.
+    """
+    return line_items(worklogs, detail=detail).iterator(chunk_size=chunk_size)
+
+
+def project_subtotals(worklogs):
+    """
+    Hours and cost per project for `worklogs`, computed in the database.
+    """
+    return (
+        with_rates(worklogs)
+        .values(
+            project_id=F("function__feature__project_id"),
+            project_title=F("function__feature__project__title"),
+        )
+        .annotate(
+            hours=Sum("hours_worked"),
+            cost=Sum("cost", output_field=MONEY),
+        )
+        .order_by("project_title")
+    )
+
+
+def grand_total(worklogs):
+    return with_rates(worklogs).aggregate(
+        total=Coalesce(Sum("cost"), Value(Decimal("0")), output_field=MONEY)
+    )["total"]
+
+
+def clients_with_billable_worklogs(*, start_date, end_date):
+    """
+    Ids of every client with unbilled worklogs in the period, in one query.
+    """
+    return (
+        WorkLog.objects.filter(
+            billed_status=WorkLog.BillingStatus.UNBILLED,
+            date_logged__range=(start_date, end_date),
+            function__feature__project__client__isnull=False,
+        )
+        .values_list("function__feature__project__client_id", flat=True)
+        .order_by()
+        .distinct()
+    )
+
+
+def lock_client_for_billing(client_id):
+    """
+    Serialize billing of one client for the rest of the current transaction.
+
+    On PostgreSQL this takes a transaction-scoped advisory lock, so parallel
+    workers billing different clients never wait on each other and two
+    workers billing the same client run one after the other. Other backends
+    rely on `select_for_update` alone.
+    """
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(%s, %s)",
+            [BILLING_LOCK_NAMESPACE, client_id],
+        )
+
+
+def bill_client(*, client_id, start_date, end_date):
+    """
+    Claim a client's unbilled worklogs for the period and invoice them.
+
+    Everything happens in one transaction: the worklogs are locked, priced,
+    attached to a new invoice carrying the total and flipped to billed with
+    a single UPDATE. Rows locked by another transaction are skipped rather
+    than waited on. Returns None when there was nothing left to bill.
+    """
+    with transaction.atomic():
+        lock_client_for_billing(client_id)
+        claimed_ids = list(
+            billable_worklogs(
+                client_id=client_id,
+                start_date=start_date,
+                end_date=end_date,
+            )
+            .select_for_update(skip_locked=True, of=("self",))
+            .values_list("id", flat=True)
+        )
+        if not claimed_ids:
+            return None
+
+        claimed = WorkLog.objects.filter(id__in=claimed_ids)
+        invoice = Invoice.objects.create(
+            client_id=client_id,
+            from_date=start_date,
+            to_date=end_date,
+            amount=grand_total(claimed),
+        )
+        today = timezone.localdate()
+        claimed.update(
+            invoice=invoice,
+            billed_status=WorkLog.BillingStatus.BILLED,
+            billed_date=today,
+            processed_date=today,
+        )
+        invalidate_model(WorkLog)
+        invalidate_timesheets()
+    return invoice
@@ -3,7 +3,13 @@ from factory.django import DjangoModelFactory
 
 from authentication.factories import UserFactory
 from authentication.models import User
-from project_management.models import Feature, Function, Project, WorkLog
+from project_management.models import (
+    Feature,
+    Function,
+    Project,
+    ProjectRate,
+    WorkLog,
+)
 
 
 class ProjectFactory(DjangoModelFactory):
@@ -47,13 +53,13 @@ class FunctionFactory(DjangoModelFactory):
     description = Faker("sentence")
     developer = SubFactory(UserFactory, role=User.Role.DEVELOPER)
     feature = SubFactory(FeatureFactory)
+    estimated_time = Faker("pyint", min_value=10, max_value=100)
 
     class Meta:
         model = Function
 
 
 class WorkLogFactory(DjangoModelFactory):
-    project = SubFactory(ProjectFactory)
     developer = SubFactory(UserFactory, role=User.Role.DEVELOPER)
     function = SubFactory(FunctionFactory)
     hours_worked = Faker("pyint", min_value=1, max_value=10)
@@ -61,3 +67,12 @@ class WorkLogFactory(DjangoModelFactory):
 
     class Meta:
         model = WorkLog
+
+
+class ProjectRateFactory(DjangoModelFactory):
+    project = SubFactory(ProjectFactory)
+    developer = SubFactory(UserFactory, role=User.Role.DEVELOPER)
+    rate = Faker("pyint", min_value=10, max_value=100)
+
+    class Meta:
+        model = ProjectRate
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from project_management.rollups import (
+    rebuild_logged_hours,
+    rebuild_rollups,
+    rollup_mismatches,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the stored cost and estimate rollups on features and projects "
+        "and the logged hours on functions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only report rollups that differ from what they sum up.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["verify"]:
+            with transaction.atomic():
+                rebuild_rollups()
+                rebuild_logged_hours()
+            self.stdout.write(self.style.SUCCESS("Rebuilt rollups"))
+
+        mismatches = rollup_mismatches()
+        for row_id, hours, actual_hours in mismatches["functions"]:
+            self.stdout.write(
+                f"function {row_id}: logged hours {hours} != {actual_hours}"
+            )
+        for kind in ("features", "projects"):
+            for row_id, cost, actual_cost, time, actual_time in mismatches[kind]:
+                self.stdout.write(
+                    f"{kind[:-1]} {row_id}: cost {cost} != {actual_cost}, "
+                    f"estimated time {time} != {actual_time}"
+                )
+        if any(mismatches.values()):
+            raise CommandError("Rollups do not match what they sum up")
+        self.stdout.write(self.style.SUCCESS("Rollups are consistent"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from project_management.rates import reprice_functions
+
+
+class Command(BaseCommand):
+    help = "Recompute function costs from the current developer rates."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--project", type=int, help="Only this project's functions."
+        )
+        parser.add_argument(
+            "--developer", type=int, help="Only this developer's functions."
+        )
+
+    def handle(self, *args, **options):
+        repriced = reprice_functions(
+            project_id=options["project"],
+            developer_id=options["developer"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Repriced {repriced} functions"))
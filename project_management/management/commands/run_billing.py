@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from project_management.models import BillingRun
+from project_management.tasks import dispatch_billing_run_task
+
+
+class Command(BaseCommand):
+    help = "Queue a billing run that invoices every client with unbilled worklogs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("start_date", type=date.fromisoformat)
+        parser.add_argument("end_date", type=date.fromisoformat)
+
+    def handle(self, *args, **options):
+        start_date = options["start_date"]
+        end_date = options["end_date"]
+        if start_date > end_date:
+            raise CommandError("start_date must be before end_date")
+
+        billing_run = BillingRun.objects.create(
+            start_date=start_date,
+            end_date=end_date,
+        )
+        dispatch_billing_run_task.delay(billing_run.id)
+        self.stdout.write(self.style.SUCCESS(f"Queued billing run {billing_run.id}"))
@@ -0,0 +1,80 @@
+"""
+Project membership of clients and developers.
+
+`visible_project_ids` resolves the ids of the projects a user can see once
+per request or task (core.memo) and caches them across requests in the
+Django cache. Changes to `Project.developers` and `Project.client`
+invalidate the affected users (see project_management.signals), so the
+role-scoped querysets can filter on a plain `project_id IN (...)`.
+"""
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+
+from core.memo import scoped_memo
+
+User = get_user_model()
+
+MEMBERSHIP_CACHE_TIMEOUT = 60 * 60
+
+MEMO_NAMESPACE = "project-membership"
+
+
+def _cache_key(user_id):
+    return f"project-membership:{user_id}"
+
+
+def _member_project_ids(user):
+    from project_management.models import Project
+
+    if user.role == User.Role.CLIENT:
+        projects = Project.objects.filter(client_id=user.id)
+        return frozenset(projects.values_list("id", flat=True))
+    memberships = Project.developers.through.objects.filter(user_id=user.id)
+    return frozenset(memberships.values_list("project_id", flat=True))
+
+
+def visible_project_ids(user):
+    """
+    Ids of the projects a client or developer belongs to.
+
+    Returns None for other roles, which are not scoped to projects.
+    """
+    if user.role not in (User.Role.CLIENT, User.Role.DEVELOPER):
+        return None
+
+    memo = scoped_memo(MEMO_NAMESPACE)
+    if memo is not None and user.id in memo:
+        return memo[user.id]
+    project_ids = cache.get(_cache_key(user.id))
+    if project_ids is None:
+        project_ids = _member_project_ids(user)
+        cache.set(_cache_key(user.id), project_ids, MEMBERSHIP_CACHE_TIMEOUT)
+    if memo is not None:
+        memo[user.id] = project_ids
+    return project_ids
+
+
+def scope_to_projects(queryset, user, project_field="project_id"):
+    """
+    Filter `queryset` to the projects `user` can see through `project_field`.
+    """
+    project_ids = visible_project_ids(user)
+    if project_ids is None:
+        return queryset
+    return queryset.filter(**{f"{project_field}__in": project_ids})
+
+
+def invalidate_membership(user_ids):
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    memo = scoped_memo(MEMO_NAMESPACE)
+    if memo is not None:
+        for user_id in user_ids:
+            memo.pop(user_id, None)
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # A concurrent reader may re-cache the old membership before this commits.
+    transaction.on_commit(lambda: cache.delete_many(keys))
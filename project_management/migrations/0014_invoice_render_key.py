@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("project_management", "0013_billingrun"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="historicalinvoice",
+            name="render_key",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="render_key",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
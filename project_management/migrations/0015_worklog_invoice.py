@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("project_management", "0014_invoice_render_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="historicalworklog",
+            name="invoice",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to="project_management.invoice",
+            ),
+        ),
+        migrations.AddField(
+            model_name="worklog",
+            name="invoice",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="work_logs",
+                to="project_management.invoice",
+            ),
+        ),
+    ]
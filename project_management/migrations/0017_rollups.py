@@ -0,0 +1,102 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:29
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def _sum_of(queryset, group_by, field):
+    return Coalesce(
+        Subquery(
+            queryset.values(group_by)
+            .annotate(total=Sum(field))
+            .values("total")
+            .order_by()[:1]
+        ),
+        Value(0),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def populate_rollups(apps, schema_editor):
+    Feature = apps.get_model("project_management", "Feature")
+    Function = apps.get_model("project_management", "Function")
+    Project = apps.get_model("project_management", "Project")
+
+    functions = Function.objects.filter(feature=OuterRef("pk"))
+    Feature.objects.update(
+        total_cost=_sum_of(functions, "feature", "cost"),
+        total_estimated_time=_sum_of(functions, "feature", "estimated_time"),
+    )
+    features = Feature.objects.filter(project=OuterRef("pk"))
+    Project.objects.update(
+        total_cost=_sum_of(features, "project", "total_cost"),
+        total_estimated_time=_sum_of(features, "project", "total_estimated_time"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("project_management", "0016_invoicejob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="feature",
+            name="total_cost",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddField(
+            model_name="feature",
+            name="total_estimated_time",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=10
+            ),
+        ),
+        migrations.AddField(
+            model_name="historicalfeature",
+            name="total_cost",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddField(
+            model_name="historicalfeature",
+            name="total_estimated_time",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=10
+            ),
+        ),
+        migrations.AddField(
+            model_name="historicalproject",
+            name="total_cost",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddField(
+            model_name="historicalproject",
+            name="total_estimated_time",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=10
+            ),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="total_cost",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="total_estimated_time",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=10
+            ),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
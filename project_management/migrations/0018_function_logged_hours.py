@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:34
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_logged_hours(apps, schema_editor):
+    Function = apps.get_model("project_management", "Function")
+    WorkLog = apps.get_model("project_management", "WorkLog")
+
+    Function.objects.update(
+        logged_hours=Coalesce(
+            Subquery(
+                WorkLog.objects.filter(function=OuterRef("pk"))
+                .values("function")
+                .annotate(total=Sum("hours_worked"))
+                .values("total")
+                .order_by()[:1]
+            ),
+            Value(0),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("project_management", "0017_rollups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="function",
+            name="logged_hours",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=10
+            ),
+        ),
+        migrations.AddField(
+            model_name="historicalfunction",
+            name="logged_hours",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=10
+            ),
+        ),
+        migrations.RunPython(populate_logged_hours, migrations.RunPython.noop),
+    ]
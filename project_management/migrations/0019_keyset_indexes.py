@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("project_management", "0018_function_logged_hours"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["generated_date", "id"], name="invoice_date_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="worklog",
+            index=models.Index(
+                fields=["date_logged", "id"], name="worklog_date_id_idx"
+            ),
+        ),
+    ]
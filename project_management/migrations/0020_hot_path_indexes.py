@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("project_management", "0019_keyset_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["client", "generated_date", "id"],
+                name="invoice_client_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="worklog",
+            index=models.Index(
+                fields=["billed_status", "date_logged"], name="worklog_billing_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="worklog",
+            index=models.Index(
+                fields=["developer", "date_logged", "id"], name="worklog_dev_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="worklog",
+            index=models.Index(
+                fields=["status", "date_logged"], name="worklog_status_idx"
+            ),
+        ),
+    ]
@@ -1,9 +1,16 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
 from simple_history.models import HistoricalRecords
 
 from core.models import BaseHistoryModel
-from project_management.utils import get_developer_rate
+from project_management.rates import get_rate
+from project_management.rollups import (
+    ROLLUP_FIELDS,
+    apply_function_change,
+    apply_worklog_change,
+    log_hours,
+    move_feature_rollup,
+)
 
 User = get_user_model()
 
@@ -18,8 +25,38 @@ class DeveloperProfile(models.Model):
     availability = models.BooleanField(default=True)
 
 
+class RollupModel(models.Model):
+    """
+    Stored sums of the cost and estimated time of the functions below.
+
+    The totals are maintained with F() deltas (see project_management.rollups),
+    so ordinary saves leave them out instead of writing back a value that
+    may be stale by the time the instance is saved.
+    """
+
+    total_cost = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, editable=False
+    )
+    total_estimated_time = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0, editable=False
+    )
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ("total_cost", "total_estimated_time")
+            ]
+        super().save(*args, **kwargs)
+
+
 # Project Model
-class Project(models.Model):
+class Project(RollupModel):
     class Status(models.TextChoices):
         NEGOTIATING = "negotiating", "Negotiating"
         SECURED = "secured", "Secured"
@@ -73,7 +110,7 @@ class ProjectRate(models.Model):
 
 
 # Feature Model
-class Feature(models.Model):
+class Feature(RollupModel):
     class Status(models.TextChoices):
         BACKLOG = "backlog", "Backlog"
         SPECS = "specs", "Specs"
@@ -90,18 +127,29 @@ class Feature(models.Model):
 
     history = HistoricalRecords()
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous_project_id = None
+            if not self._state.adding:
+                previous_project_id = (
+                    Feature.objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list("project_id", flat=True)
+                    .first()
+                )
+            super().save(*args, **kwargs)
+            if previous_project_id not in (None, self.project_id):
+                move_feature_rollup(
+                    feature_id=self.pk,
+                    from_project_id=previous_project_id,
+                    to_project_id=self.project_id,
+                )
+
     def calculate_cost(self):
-        return (
-            self.functions.aggregate(total_cost=models.Sum("cost"))["total_cost"] or 0
-        )
+        return self.total_cost
 
     def calculate_estimated_time(self):
-        return (
-            self.functions.aggregate(total_time=models.Sum("estimated_time"))[
-                "total_time"
-            ]
-            or 0
-        )
+        return self.total_estimated_time
 
     def __str__(self):
         return self.title
@@ -141,16 +189,47 @@ class Function(models.Model):
     cost = models.DecimalField(
         max_digits=10, decimal_places=2, null=True, blank=True, editable=False
     )
+    # Sum of the hours of the function's worklogs, maintained by WorkLog.save.
+    logged_hours = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0, editable=False
+    )
 
     history = HistoricalRecords()
 
     def save(self, *args, **kwargs):
-        developer_rate = get_developer_rate(
-            project=self.project,
-            developer=self.developer,
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "logged_hours"
+            ]
+        developer_rate = get_rate(
+            project_id=self.feature.project_id,
+            developer_id=self.developer_id,
         )
         self.cost = self.estimated_time * developer_rate
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = (
+                    Function.objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list(*ROLLUP_FIELDS)
+                    .first()
+                )
+            super().save(*args, **kwargs)
+            current = tuple(getattr(self, field) for field in ROLLUP_FIELDS)
+            update_fields = kwargs.get("update_fields")
+            if previous is not None and update_fields is not None:
+                # Fields left out of the save still hold their stored value.
+                saved = {
+                    name for field in update_fields for name in (field, f"{field}_id")
+                }
+                current = tuple(
+                    value if field in saved else old
+                    for field, value, old in zip(ROLLUP_FIELDS, current, previous)
+                )
+            apply_function_change(previous, current)
 
     def __str__(self):
         return self.title
@@ -188,9 +267,64 @@ class WorkLog(models.Model):
         choices=BillingStatus.choices,
         default=BillingStatus.UNBILLED,
     )
+    invoice = models.ForeignKey(
+        "Invoice",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="work_logs",
+    )
 
     history = HistoricalRecords()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["date_logged", "id"], name="worklog_date_id_idx"),
+            # Unbilled worklogs of a period, for billing.
+            models.Index(
+                fields=["billed_status", "date_logged"], name="worklog_billing_idx"
+            ),
+            # A developer's worklogs, newest first.
+            models.Index(
+                fields=["developer", "date_logged", "id"], name="worklog_dev_date_idx"
+            ),
+            # The review queue and WorkLogFilter's status filter.
+            models.Index(fields=["status", "date_logged"], name="worklog_status_idx"),
+        ]
+
+    def save(self, *args, check_estimate=False, **kwargs):
+        """
+        Save the worklog and keep its function's logged hours in step.
+
+        With `check_estimate`, a new worklog is refused with FunctionCompleted
+        once the function's logged hours have reached its estimate.
+        """
+        with transaction.atomic():
+            if self._state.adding:
+                log_hours(
+                    function_id=self.function_id,
+                    hours=self.hours_worked,
+                    check_estimate=check_estimate,
+                )
+                super().save(*args, **kwargs)
+                return
+            previous = (
+                WorkLog.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values_list("function_id", "hours_worked")
+                .first()
+            )
+            super().save(*args, **kwargs)
+            current = (self.function_id, self.hours_worked)
+            update_fields = kwargs.get("update_fields")
+            if previous is not None and update_fields is not None:
+                saved = set(update_fields)
+                current = (
+                    current[0] if saved & {"function", "function_id"} else previous[0],
+                    current[1] if "hours_worked" in saved else previous[1],
+                )
+            apply_worklog_change(previous, current)
+
 
 # Invoice Model
 class Invoice(models.Model):
@@ -214,5 +348,87 @@ class Invoice(models.Model):
     to_date = models.DateField(null=True, blank=True)
     generated_date = models.DateField(auto_now_add=True)
     pdf_file = models.FileField(upload_to="invoices/pdfs/", null=True, blank=True)
+    render_key = models.CharField(max_length=64, blank=True, db_index=True)
+
+    history = HistoricalRecords()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["generated_date", "id"], name="invoice_date_id_idx"),
+            # A client's invoices, newest first.
+            models.Index(
+                fields=["client", "generated_date", "id"],
+                name="invoice_client_date_idx",
+            ),
+        ]
+
+
+# Billing Run Model
+class BillingRun(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        RUNNING = "running", "Running"
+        COMPLETED = "completed", "Completed"
+        FAILED = "failed", "Failed"
+
+    start_date = models.DateField()
+    end_date = models.DateField()
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.PENDING
+    )
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="billing_runs",
+    )
+    client_count = models.PositiveIntegerField(default=0)
+    invoice_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    results = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    history = HistoricalRecords()
+
+
+# Invoice Job Model
+class InvoiceJob(models.Model):
+    class Stage(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        PRICING = "pricing", "Pricing"
+        RENDERING = "rendering", "Rendering"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    idempotency_key = models.CharField(max_length=64, db_index=True)
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    client = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        limit_choices_to={"role": User.Role.CLIENT},
+        related_name="invoice_jobs",
+    )
+    start_date = models.DateField()
+    end_date = models.DateField()
+    stage = models.CharField(max_length=20, choices=Stage.choices, default=Stage.QUEUED)
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="jobs",
+    )
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     history = HistoricalRecords()
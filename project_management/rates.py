@@ -0,0 +1,144 @@
+"""
+Developer rate resolution for (project, developer) pairs.
+
+Rates are memoized for the current request or task and cached in the
+Django cache. ProjectRate writes invalidate the affected pairs (see
+project_management.signals). A pair without a ProjectRate resolves to 0.
+`reprice_functions` brings stored `Function.cost` values in line with the
+current rates.
+"""
+
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from core.memo import scoped_memo
+from core.response_cache import invalidate_model
+
+RATE_CACHE_TIMEOUT = 60 * 60
+
+MEMO_NAMESPACE = "project-rates"
+
+ZERO = Decimal("0")
+
+
+def _cache_key(pair):
+    return "project-rate:{}:{}".format(*pair)
+
+
+def get_rates(pairs):
+    """
+    Rates for many (project_id, developer_id) pairs with at most one query.
+    """
+    from project_management.models import ProjectRate
+
+    memo = scoped_memo(MEMO_NAMESPACE)
+    rates = {}
+    missing = []
+    for pair in set(pairs):
+        if None in pair:
+            rates[pair] = ZERO
+        elif memo is not None and pair in memo:
+            rates[pair] = memo[pair]
+        else:
+            missing.append(pair)
+    if not missing:
+        return rates
+
+    cached = cache.get_many([_cache_key(pair) for pair in missing])
+    resolved = {
+        pair: cached[_cache_key(pair)] for pair in missing if _cache_key(pair) in cached
+    }
+    unresolved = [pair for pair in missing if pair not in resolved]
+    if unresolved:
+        stored = {
+            (project_id, developer_id): rate
+            for project_id, developer_id, rate in ProjectRate.objects.filter(
+                project_id__in={project_id for project_id, _ in unresolved},
+                developer_id__in={developer_id for _, developer_id in unresolved},
+            ).values_list("project_id", "developer_id", "rate")
+        }
+        fetched = {pair: stored.get(pair, ZERO) for pair in unresolved}
+        cache.set_many(
+            {_cache_key(pair): rate for pair, rate in fetched.items()},
+            RATE_CACHE_TIMEOUT,
+        )
+        resolved.update(fetched)
+
+    if memo is not None:
+        memo.update(resolved)
+    rates.update(resolved)
+    return rates
+
+
+def get_rate(*, project_id, developer_id):
+    pair = (project_id, developer_id)
+    return get_rates([pair])[pair]
+
+
+def invalidate_rate(*, project_id, developer_id):
+    pair = (project_id, developer_id)
+    memo = scoped_memo(MEMO_NAMESPACE)
+    if memo is not None:
+        memo.pop(pair, None)
+    key = _cache_key(pair)
+    cache.delete(key)
+    # A concurrent reader may re-cache the old rate before this commits.
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def _repriced_cost():
+    from project_management.models import Function, ProjectRate
+
+    rate = Subquery(
+        ProjectRate.objects.filter(
+            project__features=OuterRef("feature_id"),
+            developer_id=OuterRef("developer_id"),
+        ).values("rate")[:1]
+    )
+    cost = Function._meta.get_field("cost")
+    return F("estimated_time") * Coalesce(rate, Value(ZERO), output_field=cost)
+
+
+def reprice_functions(*, project_id=None, developer_id=None):
+    """
+    Recompute `Function.cost` from the current rates with one UPDATE.
+
+    Only functions whose cost actually changes are written; they get one
+    history row each, created in bulk, and the rollups of their features
+    and projects are rebuilt. Returns the number of repriced functions.
+    """
+    from project_management.models import Function
+    from project_management.rollups import rebuild_rollups
+
+    functions = Function.objects.all()
+    if project_id is not None:
+        functions = functions.filter(feature__project_id=project_id)
+    if developer_id is not None:
+        functions = functions.filter(developer_id=developer_id)
+
+    with transaction.atomic():
+        changed = dict(
+            functions.select_for_update(of=("self",))
+            .alias(repriced=_repriced_cost())
+            .exclude(
+                Q(cost=F("repriced"))
+                | Q(cost__isnull=True, estimated_time__isnull=True)
+            )
+            .values_list("id", "feature_id")
+        )
+        if not changed:
+            return 0
+
+        Function.objects.filter(id__in=changed).update(cost=_repriced_cost())
+        invalidate_model(Function)
+        Function.history.bulk_history_create(
+            list(Function.objects.filter(id__in=changed)),
+            update=True,
+            default_change_reason="Repriced",
+        )
+        rebuild_rollups(feature_ids=set(changed.values()))
+    return len(changed)
@@ -0,0 +1,100 @@
+"""
+Content-addressed cache for rendered invoice PDFs.
+
+A render key is the SHA-256 of the normalized template context plus the
+version of the rendering assets, so the same invoice content rendered with
+the same template and static files always maps to the same key. Line items
+are hashed one at a time, so a key can be built while the items stream
+past. Rendered files are stored under the SHA-256 of their bytes, which
+makes identical PDFs share a single file in `media/invoices/pdfs/` no
+matter how many invoices point at it.
+"""
+
+import hashlib
+import json
+from datetime import date
+from decimal import Decimal
+
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+
+from project_management.models import Invoice
+
+PDF_DIRECTORY = "invoices/pdfs"
+
+
+def _normalize(value):
+    if isinstance(value, Decimal):
+        return format(value.normalize(), "f")
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Cannot normalize {type(value).__name__} for a render key")
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(
+        value, sort_keys=True, separators=(",", ":"), default=_normalize
+    ).encode("utf-8")
+
+
+class RenderKey:
+    def __init__(self, context: dict, assets_version: str):
+        self._digest = hashlib.sha256(assets_version.encode("ascii"))
+        self._digest.update(_dumps(context))
+
+    def add_item(self, item: dict) -> None:
+        self._digest.update(_dumps(item))
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+def render_key(context: dict, assets_version: str) -> str:
+    context = dict(context)
+    items = context.pop("invoice_items", [])
+    key = RenderKey(context, assets_version)
+    for item in items:
+        key.add_item(item)
+    return key.hexdigest()
+
+
+def cached_pdf(key: str):
+    """
+    Storage name of a PDF already rendered for `key`, if it still exists.
+    """
+    names = (
+        Invoice.objects.filter(render_key=key)
+        .exclude(pdf_file="")
+        .exclude(pdf_file__isnull=True)
+        .values_list("pdf_file", flat=True)
+    )
+    for name in names[:1]:
+        if default_storage.exists(name):
+            return name
+    return None
+
+
+def store_pdf(pdf_bytes: bytes) -> str:
+    """
+    Save `pdf_bytes` under its content hash, reusing an identical stored file.
+    """
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    name = f"{PDF_DIRECTORY}/{digest}.pdf"
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(pdf_bytes))
+    return name
+
+
+def store_pdf_file(path: str) -> str:
+    """
+    Like `store_pdf`, for a rendered PDF on disk, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as pdf_file:
+        for chunk in iter(lambda: pdf_file.read(64 * 1024), b""):
+            digest.update(chunk)
+        name = f"{PDF_DIRECTORY}/{digest.hexdigest()}.pdf"
+        if not default_storage.exists(name):
+            pdf_file.seek(0)
+            name = default_storage.save(name, File(pdf_file))
+    return name
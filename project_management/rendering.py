@@ -0,0 +1,369 @@
+"""
+PDF rendering backends for invoices.
+
+The backend is chosen with the `PDF_RENDERER` setting:
+
+    PDF_RENDERER = {
+        "BACKEND": "project_management.rendering.PooledRenderer",
+        "OPTIONS": {"command": [...], "size": 4},
+    }
+
+`PdfkitRenderer` forks a wkhtmltopdf process per document. `PooledRenderer`
+keeps a bounded set of long-lived renderer processes and talks to them over
+their stdin/stdout pipes, so process start-up is paid once per worker
+instead of once per invoice. A pooled renderer process must speak this
+framing, one document at a time:
+
+    request:  4-byte big-endian length, then the UTF-8 HTML
+    response: 1 status byte (0 = ok, 1 = error), 4-byte big-endian length,
+              then the PDF bytes (or a UTF-8 error message)
+"""
+
+import io
+import logging
+import os
+import queue
+import select
+import struct
+import subprocess
+import threading
+import time
+from functools import lru_cache
+
+import pdfkit
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PDF_OPTIONS = {
+    "page-size": "A4",
+    "encoding": "UTF-8",
+    "enable-local-file-access": "",
+}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_LENGTH = struct.Struct(">I")
+_STATUS = struct.Struct(">B")
+
+
+class RenderError(Exception):
+    pass
+
+
+class BaseRenderer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            "documents": 0,
+            "failures": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "render_seconds": 0.0,
+        }
+
+    def render(self, html: str) -> bytes:
+        raise NotImplementedError
+
+    def render_file(self, html_path: str, pdf_path: str) -> None:
+        """
+        Render the HTML document at `html_path` into `pdf_path`.
+
+        Backends override this to avoid holding either document in memory.
+        """
+        with open(html_path, encoding="utf-8") as html_file:
+            pdf = self.render(html_file.read())
+        with open(pdf_path, "wb") as pdf_file:
+            pdf_file.write(pdf)
+
+    def close(self) -> None:
+        pass
+
+    def _count(self, **deltas) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counters[name] = self._counters.get(name, 0) + delta
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+        seconds = stats["render_seconds"]
+        stats["documents_per_second"] = stats["documents"] / seconds if seconds else 0.0
+        return stats
+
+
+class PdfkitRenderer(BaseRenderer):
+    """
+    Render through pdfkit, starting a new wkhtmltopdf process per document.
+    """
+
+    def __init__(self, options=None, configuration=None):
+        super().__init__()
+        self.options = options or PDF_OPTIONS
+        self.configuration = configuration
+
+    def render(self, html: str) -> bytes:
+        started = time.monotonic()
+        try:
+            pdf = pdfkit.from_string(
+                html,
+                False,
+                options=self.options,
+                configuration=self.configuration,
+            )
+        except Exception:
+            self._count(failures=1)
+            raise
+        self._count(
+            documents=1,
+            bytes_in=len(html),
+            bytes_out=len(pdf),
+            render_seconds=time.monotonic() - started,
+        )
+        return pdf
+
+    def render_file(self, html_path: str, pdf_path: str) -> None:
+        started = time.monotonic()
+        try:
+            pdfkit.from_file(
+                html_path,
+                pdf_path,
+                options=self.options,
+                configuration=self.configuration,
+            )
+        except Exception:
+            self._count(failures=1)
+            raise
+        self._count(
+            documents=1,
+            bytes_in=os.path.getsize(html_path),
+            bytes_out=os.path.getsize(pdf_path),
+            render_seconds=time.monotonic() - started,
+        )
+
+
+class _RendererProcess:
+    def __init__(self, command):
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        # Writes go through _write() so that they honour the deadline too.
+        os.set_blocking(self.process.stdin.fileno(), False)
+        self.documents = 0
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def rss_mb(self):
+        try:
+            with open(f"/proc/{self.pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def render(self, source, size: int, target, timeout: float) -> int:
+        """
+        Stream `size` bytes of HTML from `source` and the PDF into `target`.
+        """
+        deadline = time.monotonic() + timeout
+        self._write(_LENGTH.pack(size), deadline)
+        while chunk := source.read(STREAM_CHUNK_SIZE):
+            self._write(chunk, deadline)
+
+        (status,) = _STATUS.unpack(self._read(_STATUS.size, deadline))
+        (length,) = _LENGTH.unpack(self._read(_LENGTH.size, deadline))
+        self.documents += 1
+        if status != 0:
+            message = self._read(length, deadline)
+            raise RenderError(message.decode("utf-8", errors="replace"))
+
+        remaining = length
+        while remaining:
+            chunk = self._read(min(remaining, STREAM_CHUNK_SIZE), deadline)
+            target.write(chunk)
+            remaining -= len(chunk)
+        return length
+
+    def _write(self, data: bytes, deadline: float) -> None:
+        fd = self.process.stdin.fileno()
+        view = memoryview(data)
+        while view:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or not select.select([], [fd], [], timeout)[1]:
+                raise RenderError(f"Renderer {self.pid} timed out")
+            try:
+                view = view[os.write(fd, view) :]
+            except BlockingIOError:
+                continue
+
+    def _read(self, size: int, deadline: float) -> bytes:
+        fd = self.process.stdout.fileno()
+        chunks = []
+        remaining = size
+        while remaining:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or not select.select([fd], [], [], timeout)[0]:
+                raise RenderError(f"Renderer {self.pid} timed out")
+            chunk = os.read(fd, remaining)
+            if not chunk:
+                raise RenderError(f"Renderer {self.pid} exited unexpectedly")
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    def stop(self) -> None:
+        if self.is_alive():
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class PooledRenderer(BaseRenderer):
+    """
+    Render through a bounded pool of long-lived renderer processes.
+
+    Processes are started lazily up to `size` and reused across documents.
+    A process is recycled after `max_documents` renders or once its resident
+    memory exceeds `max_rss_mb`, and is discarded after any failure. When no
+    `command` is configured, or a pooled render fails, the document is
+    rendered by the `fallback` backend instead.
+    """
+
+    def __init__(
+        self,
+        command=None,
+        size=2,
+        max_documents=200,
+        max_rss_mb=512,
+        timeout=60,
+        fallback=None,
+    ):
+        super().__init__()
+        self.command = command
+        self.size = size
+        self.max_documents = max_documents
+        self.max_rss_mb = max_rss_mb
+        self.timeout = timeout
+        self.fallback = fallback or PdfkitRenderer()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._counters.update(spawned=0, recycled=0, fallbacks=0)
+
+    def render(self, html: str) -> bytes:
+        if self.command:
+            payload = html.encode("utf-8")
+            pdf = io.BytesIO()
+            if self._render_pooled(io.BytesIO(payload), len(payload), pdf):
+                return pdf.getvalue()
+        self._count(fallbacks=1)
+        return self.fallback.render(html)
+
+    def render_file(self, html_path: str, pdf_path: str) -> None:
+        if self.command:
+            size = os.path.getsize(html_path)
+            with open(html_path, "rb") as source, open(pdf_path, "wb") as target:
+                if self._render_pooled(source, size, target):
+                    return
+        self._count(fallbacks=1)
+        self.fallback.render_file(html_path, pdf_path)
+
+    def _render_pooled(self, source, size: int, target) -> bool:
+        started = time.monotonic()
+        with self._slots:
+            try:
+                process = self._checkout()
+            except OSError:
+                logger.exception("Cannot start pooled renderer %s", self.command)
+                self._count(failures=1)
+                return False
+            try:
+                written = process.render(source, size, target, self.timeout)
+            except (OSError, RenderError):
+                logger.exception("Pooled renderer %s failed", process.pid)
+                process.stop()
+                self._count(failures=1)
+                return False
+            self._checkin(process)
+
+        self._count(
+            documents=1,
+            bytes_in=size,
+            bytes_out=written,
+            render_seconds=time.monotonic() - started,
+        )
+        return True
+
+    def _checkout(self) -> _RendererProcess:
+        while True:
+            try:
+                process = self._idle.get_nowait()
+            except queue.Empty:
+                self._count(spawned=1)
+                return _RendererProcess(self.command)
+            if process.is_alive():
+                return process
+
+    def _checkin(self, process: _RendererProcess) -> None:
+        rss_mb = process.rss_mb()
+        if process.documents >= self.max_documents or (
+            rss_mb is not None and rss_mb > self.max_rss_mb
+        ):
+            process.stop()
+            self._count(recycled=1)
+            return
+        self._idle.put(process)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["idle"] = self._idle.qsize()
+        stats["fallback"] = self.fallback.stats()
+        return stats
+
+
+@lru_cache(maxsize=None)
+def get_renderer() -> BaseRenderer:
+    """
+    The process-wide renderer configured by the `PDF_RENDERER` setting.
+    """
+    config = getattr(settings, "PDF_RENDERER", {})
+    backend = import_string(
+        config.get("BACKEND", "project_management.rendering.PdfkitRenderer")
+    )
+    return backend(**config.get("OPTIONS", {}))
+
+
+@receiver(setting_changed)
+def reset_renderer(*, setting, **kwargs):
+    if setting == "PDF_RENDERER":
+        get_renderer.cache_clear()
+
+
+def render_pdf(html: str) -> bytes:
+    return get_renderer().render(html)
+
+
+def render_pdf_file(html_path: str, pdf_path: str) -> None:
+    get_renderer().render_file(html_path, pdf_path)
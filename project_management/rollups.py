@@ -0,0 +1,267 @@
+"""
+Stored cost and estimate rollups on Feature and Project.
+
+`Feature.total_cost`/`total_estimated_time` hold the sums over the feature's
+functions and `Project.total_cost`/`total_estimated_time` the sums over the
+project's features. Function writes keep them current with F() deltas in
+the same transaction; `rebuild_rollups` recomputes them from scratch.
+
+`Function.logged_hours` is maintained the same way from worklog writes,
+and `rebuild_logged_hours` recomputes it.
+"""
+
+from decimal import Decimal
+
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from core.response_cache import invalidate_model
+
+ZERO = Decimal("0")
+
+ROLLUP_FIELDS = ("feature_id", "cost", "estimated_time")
+
+
+class FunctionCompleted(Exception):
+    """
+    The function's logged hours already reached its estimated time.
+    """
+
+
+def apply_function_delta(*, feature_id, cost, estimated_time):
+    from project_management.models import Feature, Project
+
+    if not cost and not estimated_time:
+        return
+    changes = {
+        "total_cost": F("total_cost") + cost,
+        "total_estimated_time": F("total_estimated_time") + estimated_time,
+    }
+    Feature.objects.filter(id=feature_id).update(**changes)
+    Project.objects.filter(
+        id=Subquery(Feature.objects.filter(id=feature_id).values("project_id")[:1])
+    ).update(**changes)
+    invalidate_model(Feature)
+    invalidate_model(Project)
+
+
+def move_feature_rollup(*, feature_id, from_project_id, to_project_id):
+    """
+    Move a feature's stored totals from one project's rollup to another's.
+    """
+    from project_management.models import Feature, Project
+
+    totals = Feature.objects.filter(id=feature_id)
+    cost = Subquery(totals.values("total_cost")[:1])
+    estimated_time = Subquery(totals.values("total_estimated_time")[:1])
+    Project.objects.filter(id=from_project_id).update(
+        total_cost=F("total_cost") - cost,
+        total_estimated_time=F("total_estimated_time") - estimated_time,
+    )
+    Project.objects.filter(id=to_project_id).update(
+        total_cost=F("total_cost") + cost,
+        total_estimated_time=F("total_estimated_time") + estimated_time,
+    )
+    invalidate_model(Project)
+
+
+def apply_function_change(previous, current):
+    """
+    Move a function's contribution from `previous` to `current`.
+
+    Both are (feature_id, cost, estimated_time) tuples, or None when the
+    function did not exist before or no longer exists.
+    """
+    if previous is not None:
+        feature_id, cost, estimated_time = previous
+        if current is not None and current[0] == feature_id:
+            apply_function_delta(
+                feature_id=feature_id,
+                cost=(current[1] or ZERO) - (cost or ZERO),
+                estimated_time=(current[2] or ZERO) - (estimated_time or ZERO),
+            )
+            return
+        apply_function_delta(
+            feature_id=feature_id,
+            cost=-(cost or ZERO),
+            estimated_time=-(estimated_time or ZERO),
+        )
+    if current is not None:
+        feature_id, cost, estimated_time = current
+        apply_function_delta(
+            feature_id=feature_id,
+            cost=cost or ZERO,
+            estimated_time=estimated_time or ZERO,
+        )
+
+
+def log_hours(*, function_id, hours, check_estimate=False):
+    """
+    Add `hours` to a function's logged hours with a single UPDATE.
+
+    With `check_estimate`, the UPDATE only matches while the logged hours
+    are below the estimate (a function without an estimate is unbounded),
+    so concurrent writers cannot both slip past the limit. Raises
+    FunctionCompleted when the guard does not match.
+    """
+    from project_management.models import Function
+
+    functions = Function.objects.filter(id=function_id)
+    if check_estimate:
+        functions = functions.filter(
+            Q(estimated_time__isnull=True) | Q(logged_hours__lt=F("estimated_time"))
+        )
+    if not functions.update(logged_hours=F("logged_hours") + hours):
+        if check_estimate:
+            raise FunctionCompleted(function_id)
+        return
+    invalidate_model(Function)
+
+
+def apply_worklog_change(previous, current):
+    """
+    Move a worklog's hours from `previous` to `current`.
+
+    Both are (function_id, hours_worked) tuples, or None when the worklog
+    did not exist before or no longer exists.
+    """
+    if previous is not None:
+        function_id, hours = previous
+        if current is not None and current[0] == function_id:
+            if current[1] != hours:
+                log_hours(function_id=function_id, hours=current[1] - hours)
+            return
+        log_hours(function_id=function_id, hours=-hours)
+    if current is not None:
+        log_hours(function_id=current[0], hours=current[1])
+
+
+def _sum_of(queryset, group_by, field, output_field):
+    return Coalesce(
+        Subquery(
+            queryset.values(group_by)
+            .annotate(total=Sum(field))
+            .values("total")
+            .order_by()[:1],
+            output_field=output_field,
+        ),
+        Value(ZERO),
+        output_field=output_field,
+    )
+
+
+def rebuild_rollups(*, feature_ids=None, project_ids=None):
+    """
+    Recompute rollups with one UPDATE per table, optionally scoped.
+    """
+    from project_management.models import Feature, Function, Project
+
+    features = Feature.objects.all()
+    if feature_ids is not None:
+        features = features.filter(id__in=feature_ids)
+    functions = Function.objects.filter(feature=OuterRef("pk"))
+    features.update(
+        total_cost=_sum_of(
+            functions, "feature", "cost", Feature._meta.get_field("total_cost")
+        ),
+        total_estimated_time=_sum_of(
+            functions,
+            "feature",
+            "estimated_time",
+            Feature._meta.get_field("total_estimated_time"),
+        ),
+    )
+
+    projects = Project.objects.all()
+    if project_ids is not None:
+        projects = projects.filter(id__in=project_ids)
+    elif feature_ids is not None:
+        projects = projects.filter(features__id__in=feature_ids).distinct()
+    project_features = Feature.objects.filter(project=OuterRef("pk"))
+    Project.objects.filter(id__in=projects.values("id")).update(
+        total_cost=_sum_of(
+            project_features,
+            "project",
+            "total_cost",
+            Project._meta.get_field("total_cost"),
+        ),
+        total_estimated_time=_sum_of(
+            project_features,
+            "project",
+            "total_estimated_time",
+            Project._meta.get_field("total_estimated_time"),
+        ),
+    )
+    invalidate_model(Feature)
+    invalidate_model(Project)
+
+
+def rebuild_logged_hours(*, function_ids=None):
+    """
+    Recompute `Function.logged_hours` from the worklogs with one UPDATE.
+    """
+    from project_management.models import Function, WorkLog
+
+    functions = Function.objects.all()
+    if function_ids is not None:
+        functions = functions.filter(id__in=function_ids)
+    functions.update(
+        logged_hours=_sum_of(
+            WorkLog.objects.filter(function=OuterRef("pk")),
+            "function",
+            "hours_worked",
+            Function._meta.get_field("logged_hours"),
+        )
+    )
+    invalidate_model(Function)
+
+
+def _mismatches(queryset, cost_path, time_path):
+    money = DecimalField(max_digits=14, decimal_places=2)
+    rows = queryset.annotate(
+        actual_cost=Coalesce(Sum(cost_path), Value(ZERO), output_field=money),
+        actual_time=Coalesce(Sum(time_path), Value(ZERO), output_field=money),
+    ).values_list(
+        "id", "total_cost", "actual_cost", "total_estimated_time", "actual_time"
+    )
+    cent = Decimal("0.01")
+    for row_id, cost, actual_cost, time, actual_time in rows.iterator():
+        if cost.quantize(cent) != actual_cost.quantize(cent) or time.quantize(
+            cent
+        ) != actual_time.quantize(cent):
+            yield row_id, cost, actual_cost, time, actual_time
+
+
+def rollup_mismatches():
+    """
+    Stored rollups and logged hours that differ from what they sum up.
+    """
+    from project_management.models import Feature, Function, Project
+
+    money = DecimalField(max_digits=12, decimal_places=2)
+    functions = (
+        Function.objects.annotate(
+            actual_hours=Coalesce(
+                Sum("work_logs__hours_worked"), Value(ZERO), output_field=money
+            )
+        )
+        .exclude(logged_hours=F("actual_hours"))
+        .values_list("id", "logged_hours", "actual_hours")
+    )
+    return {
+        "functions": list(functions),
+        "features": list(
+            _mismatches(
+                Feature.objects.all(),
+                "functions__cost",
+                "functions__estimated_time",
+            )
+        ),
+        "projects": list(
+            _mismatches(
+                Project.objects.all(),
+                "features__functions__cost",
+                "features__functions__estimated_time",
+            )
+        ),
+    }
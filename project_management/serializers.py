@@ -1,24 +1,46 @@
 from django.contrib.auth import get_user_model
-from django.db import models
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.reverse import reverse
 
+from core.sparse_fields import SparseFieldsSerializerMixin
+from project_management.filters import WorkLogFilter
 from project_management.models import (
+    BillingRun,
     Feature,
     Function,
     Invoice,
+    InvoiceJob,
     Project,
     ProjectRate,
     WorkLog,
 )
+from project_management.rollups import FunctionCompleted
 
 User = get_user_model()
 
 
-class ProjectSerializer(serializers.ModelSerializer):
+class MemberSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ["id", "username", "first_name", "last_name", "email"]
+
+
+class ProjectSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Project
         fields = "__all__"
+        expandable_fields = {
+            "client": "project_management.serializers.MemberSerializer",
+            "developers": (
+                "project_management.serializers.MemberSerializer",
+                {"many": True},
+            ),
+            "features": (
+                "project_management.serializers.FeatureSerializer",
+                {"many": True},
+            ),
+        }
 
 
 class ClientFeatureUpdateSerializer(serializers.ModelSerializer):
@@ -33,16 +55,83 @@ class ClientFeatureUpdateSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class FeatureSerializer(serializers.ModelSerializer):
+class FeatureSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Feature
         fields = "__all__"
+        expandable_fields = {
+            "project": "project_management.serializers.ProjectSerializer",
+            "functions": (
+                "project_management.serializers.FunctionSerializer",
+                {"many": True},
+            ),
+        }
 
 
-class FunctionSerializer(serializers.ModelSerializer):
+class FunctionSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Function
         fields = "__all__"
+        expandable_fields = {
+            "feature": "project_management.serializers.FeatureSerializer",
+            "developer": "project_management.serializers.MemberSerializer",
+        }
+
+
+class FunctionTreeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Function
+        fields = [
+            "id",
+            "title",
+            "status",
+            "developer",
+            "estimated_time",
+            "cost",
+            "logged_hours",
+        ]
+
+
+class FeatureTreeSerializer(serializers.ModelSerializer):
+    logged_hours = serializers.DecimalField(
+        max_digits=12, decimal_places=2, read_only=True
+    )
+    function_status_counts = serializers.SerializerMethodField()
+    functions = FunctionTreeSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Feature
+        fields = [
+            "id",
+            "title",
+            "status",
+            "total_cost",
+            "total_estimated_time",
+            "logged_hours",
+            "function_status_counts",
+            "functions",
+        ]
+
+    def get_function_status_counts(self, feature):
+        counts = dict.fromkeys(Function.Status.values, 0)
+        for function in feature.functions.all():
+            counts[function.status] += 1
+        return counts
+
+
+class ProjectTreeSerializer(serializers.ModelSerializer):
+    features = FeatureTreeSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Project
+        fields = [
+            "id",
+            "title",
+            "status",
+            "total_cost",
+            "total_estimated_time",
+            "features",
+        ]
 
 
 class WorkLogListSerializer(serializers.ModelSerializer):
@@ -58,16 +147,10 @@ class WorkLogCreateSerializer(serializers.ModelSerializer):
 
     def validate(self, attrs):
         function = attrs["function"]
-
-        function = Function.objects.get_or_404(id=function.id)
-
-        total_hours_for_function = (
-            WorkLog.objects.filter(function_id=function).aggregate(
-                total_hours=models.Sum("hours_worked")
-            )["total_hours"]
-            or 0
-        )
-        if total_hours_for_function >= function.estimated_time:
+        if (
+            function.estimated_time is not None
+            and function.logged_hours >= function.estimated_time
+        ):
             raise ValidationError("Function has already been completed")
         return attrs
 
@@ -75,13 +158,93 @@ class WorkLogCreateSerializer(serializers.ModelSerializer):
         user = self.context["request"].user
         validated_data["developer"] = user
         validated_data["status"] = WorkLog.Status.REVIEW
-        return super().create(validated_data)
+        work_log = WorkLog(**validated_data)
+        try:
+            # The check in validate() can race; this one is a guarded UPDATE.
+            work_log.save(check_estimate=True)
+        except FunctionCompleted:
+            raise ValidationError("Function has already been completed")
+        return work_log
+
+
+class WorkLogEntrySerializer(serializers.ModelSerializer):
+    # A plain id: the functions of a batch are loaded together in one query.
+    function = serializers.IntegerField()
+
+    class Meta:
+        model = WorkLog
+        fields = ["function", "hours_worked", "description"]
+
+
+class WorkLogBulkCreateSerializer(serializers.Serializer):
+    entries = WorkLogEntrySerializer(many=True, allow_empty=False, max_length=1000)
+
+
+class WorkLogBulkReviewSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False
+    )
+    filter = serializers.DictField(required=False)
+    decision = serializers.ChoiceField(
+        choices=[WorkLog.Status.APPROVED, WorkLog.Status.REJECTED]
+    )
+    reason = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+
+    def validate_filter(self, value):
+        if not value:
+            raise ValidationError("Filter must not be empty")
+        unknown = set(value) - set(WorkLogFilter.base_filters)
+        if unknown:
+            raise ValidationError(f"Unknown filters {', '.join(sorted(unknown))}")
+        return value
+
+    def validate(self, attrs):
+        if ("ids" in attrs) == ("filter" in attrs):
+            raise ValidationError("Provide either ids or filter")
+        return attrs
+
+
+class TimesheetRequestSerializer(serializers.Serializer):
+    period = serializers.ChoiceField(choices=["week", "month"], default="week")
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+
+
+class TimesheetRowSerializer(serializers.Serializer):
+    period = serializers.DateField()
+    project_id = serializers.IntegerField()
+    project_title = serializers.CharField()
+    developer_id = serializers.IntegerField()
+    developer_name = serializers.CharField()
+    hours = serializers.DecimalField(max_digits=12, decimal_places=2)
+    status = serializers.DictField(
+        child=serializers.DecimalField(max_digits=12, decimal_places=2)
+    )
+    billed_status = serializers.DictField(
+        child=serializers.DecimalField(max_digits=12, decimal_places=2)
+    )
 
 
 class InvoiceSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
     class Meta:
         model = Invoice
-        fields = "__all__"
+        # PDFs are only served through the authenticated download action.
+        exclude = ["pdf_file", "render_key"]
+
+    def get_download_url(self, obj):
+        if not obj.pdf_file:
+            return None
+        return reverse(
+            "invoice-download", args=[obj.id], request=self.context.get("request")
+        )
+
+
+class InvoiceJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = InvoiceJob
+        exclude = ["idempotency_key"]
 
 
 class GenerateInvoiceSerializer(serializers.Serializer):
@@ -98,7 +261,69 @@ class GenerateInvoiceSerializer(serializers.Serializer):
         return attrs
 
 
+class InvoicePreviewRequestSerializer(GenerateInvoiceSerializer):
+    detail = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if attrs["start_date"] > attrs["end_date"]:
+            raise ValidationError("start_date must be before end_date")
+        return attrs
+
+
+class InvoiceLineItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False)
+    date_logged = serializers.DateField(required=False)
+    project_id = serializers.IntegerField()
+    project_title = serializers.CharField()
+    developer_id = serializers.IntegerField()
+    developer_name = serializers.CharField()
+    function_title = serializers.CharField(required=False)
+    function_description = serializers.CharField(required=False)
+    hours = serializers.DecimalField(max_digits=12, decimal_places=2)
+    per_hour = serializers.DecimalField(max_digits=12, decimal_places=2)
+    cost = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class ProjectSubtotalSerializer(serializers.Serializer):
+    project_id = serializers.IntegerField()
+    project_title = serializers.CharField()
+    hours = serializers.DecimalField(max_digits=12, decimal_places=2)
+    cost = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class InvoicePreviewSerializer(serializers.Serializer):
+    client = serializers.IntegerField()
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    line_items = InvoiceLineItemSerializer(many=True)
+    projects = ProjectSubtotalSerializer(many=True)
+    grand_total = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
 class ProjectRateSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProjectRate
         fields = "__all__"
+
+
+class BillingRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BillingRun
+        fields = "__all__"
+        read_only_fields = [
+            "status",
+            "requested_by",
+            "client_count",
+            "invoice_count",
+            "failed_count",
+            "total_amount",
+            "results",
+            "created_at",
+            "finished_at",
+        ]
+
+    def validate(self, attrs):
+        if attrs["start_date"] > attrs["end_date"]:
+            raise ValidationError("start_date must be before end_date")
+        return attrs
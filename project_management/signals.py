@@ -0,0 +1,148 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from core.response_cache import invalidate_model
+from project_management.membership import invalidate_membership
+from project_management.models import Function, Project, ProjectRate, WorkLog
+from project_management.rates import invalidate_rate
+from project_management.rollups import apply_function_change, apply_worklog_change
+from project_management.serializers import MemberSerializer
+from project_management.tasks import reprice_functions_task
+from project_management.timesheets import invalidate_timesheets
+
+User = get_user_model()
+
+# Fields of a developer that timesheet rows show.
+DEVELOPER_NAME_FIELDS = {"username", "first_name", "last_name"}
+
+
+@receiver(post_delete, sender=Function)
+def remove_function_from_rollups(sender, instance, **kwargs):
+    apply_function_change(
+        (instance.feature_id, instance.cost, instance.estimated_time), None
+    )
+
+
+@receiver(post_delete, sender=WorkLog)
+def remove_worklog_from_logged_hours(sender, instance, **kwargs):
+    apply_worklog_change((instance.function_id, instance.hours_worked), None)
+
+
+@receiver(post_save, sender=WorkLog)
+@receiver(post_delete, sender=WorkLog)
+def invalidate_worklog_timesheets(sender, **kwargs):
+    invalidate_timesheets()
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_project_timesheets(sender, **kwargs):
+    # Timesheet rows show project titles and are scoped by Project.client.
+    invalidate_timesheets()
+
+
+@receiver(post_save, sender=User)
+def invalidate_developer_timesheets(sender, created, update_fields, **kwargs):
+    if created:
+        return
+    # Logins only save last_login; skip saves that leave the name alone.
+    if update_fields is not None and not DEVELOPER_NAME_FIELDS & set(update_fields):
+        return
+    invalidate_timesheets()
+
+
+@receiver(post_save, sender=User)
+def invalidate_inlined_members(sender, created, update_fields, **kwargs):
+    if created:
+        return
+    if update_fields is not None and not set(MemberSerializer.Meta.fields) & set(
+        update_fields
+    ):
+        return
+    # Members are inlined into project, feature and function responses with
+    # ?expand=; all of those views depend on the Project version.
+    invalidate_model(Project)
+
+
+@receiver(pre_save, sender=ProjectRate)
+def remember_previous_rate_pair(sender, instance, **kwargs):
+    instance._previous_pair = None
+    if instance.pk is not None:
+        instance._previous_pair = (
+            ProjectRate.objects.filter(pk=instance.pk)
+            .values_list("project_id", "developer_id")
+            .first()
+        )
+
+
+@receiver(post_save, sender=ProjectRate)
+@receiver(post_delete, sender=ProjectRate)
+def invalidate_project_rate(sender, instance, **kwargs):
+    pairs = {
+        (instance.project_id, instance.developer_id),
+        getattr(instance, "_previous_pair", None),
+    }
+    for project_id, developer_id in pairs - {None}:
+        invalidate_rate(project_id=project_id, developer_id=developer_id)
+        transaction.on_commit(
+            partial(
+                reprice_functions_task.delay,
+                project_id=project_id,
+                developer_id=developer_id,
+            )
+        )
+
+
+@receiver(pre_save, sender=Project)
+def remember_previous_client(sender, instance, **kwargs):
+    instance._previous_client_id = None
+    if instance.pk is not None:
+        instance._previous_client_id = (
+            Project.objects.filter(pk=instance.pk)
+            .values_list("client_id", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Project)
+def invalidate_client_membership(sender, instance, created, **kwargs):
+    previous_client_id = getattr(instance, "_previous_client_id", None)
+    if created or previous_client_id != instance.client_id:
+        invalidate_membership({instance.client_id, previous_client_id})
+
+
+@receiver(pre_delete, sender=Project)
+def invalidate_deleted_project_membership(sender, instance, **kwargs):
+    developer_ids = instance.developers.values_list("id", flat=True)
+    invalidate_membership({instance.client_id, *developer_ids})
+
+
+@receiver(m2m_changed, sender=Project.developers.through)
+def invalidate_developer_membership(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate_timesheets()
+    if reverse:
+        # `instance` is the developer and `pk_set` holds project ids.
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_membership({instance.pk})
+        return
+    if action == "pre_clear":
+        instance._cleared_developer_ids = set(
+            instance.developers.values_list("id", flat=True)
+        )
+    elif action in ("post_add", "post_remove"):
+        invalidate_membership(pk_set)
+    elif action == "post_clear":
+        invalidate_membership(getattr(instance, "_cleared_developer_ids", set()))
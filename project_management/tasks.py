@@ -1,89 +1,274 @@
-import base64
-from datetime import datetime
-from io import BytesIO
+import hashlib
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta
+from itertools import islice
 
-import pdfkit
-from celery import shared_task
-from django.contrib.staticfiles import finders
-from django.db.models import F, Q, Sum, Value
-from django.db.models.functions import Concat
-from django.template.loader import render_to_string
+from celery import chord
+from celery.signals import worker_process_init, worker_process_shutdown
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
 
 from authentication.models import User
 from internal_ops.celery import app
-from project_management.models import Invoice, ProjectRate, WorkLog
+from project_management.assets import (
+    INVOICE_FOOT_TEMPLATE,
+    INVOICE_HEAD_TEMPLATE,
+    INVOICE_ITEMS_TEMPLATE,
+    INVOICE_TEMPLATE,
+    invoice_assets,
+)
+from project_management.billing import (
+    bill_client,
+    clients_with_billable_worklogs,
+    iter_line_items,
+    line_items,
+)
+from project_management.models import BillingRun, Invoice, InvoiceJob
+from project_management.rates import reprice_functions
+from project_management.render_cache import (
+    RenderKey,
+    cached_pdf,
+    render_key,
+    store_pdf,
+    store_pdf_file,
+)
+from project_management.rendering import get_renderer, render_pdf, render_pdf_file
+
+logger = logging.getLogger(__name__)
+
+
+@worker_process_init.connect
+def load_render_assets(**kwargs):
+    invoice_assets().load()
+
+
+@worker_process_shutdown.connect
+def close_renderer(**kwargs):
+    get_renderer().close()
+
+
+def _invoice_context(invoice: Invoice) -> dict:
+    return {
+        "client_id": invoice.client_id,
+        "from_date": invoice.from_date,
+        "to_date": invoice.to_date,
+        "grand_total": invoice.amount,
+    }
+
+
+def _attach_pdf(invoice: Invoice, key: str, pdf_name: str) -> None:
+    invoice.pdf_file.name = pdf_name
+    invoice.render_key = key
+    invoice.save(update_fields=["pdf_file", "render_key"])
+
+
+def render_invoice(invoice: Invoice, *, stream: bool | None = None) -> None:
+    """
+    Render the invoice PDF, reusing a stored PDF with identical content.
+
+    Invoices with more than `INVOICE_STREAMING_THRESHOLD` line items are
+    streamed unless `stream` says otherwise.
+    """
+    worklogs = invoice.work_logs.all()
+    if stream is None:
+        stream = line_items(worklogs).count() > settings.INVOICE_STREAMING_THRESHOLD
+    if stream:
+        _render_invoice_streaming(invoice, worklogs)
+        return
+
+    cxt = _invoice_context(invoice)
+    cxt["invoice_items"] = list(iter_line_items(worklogs))
+
+    assets = invoice_assets().current()
+    key = render_key(cxt, assets.version)
+    pdf_name = cached_pdf(key)
+    if pdf_name is None:
+        html_string = assets.render(INVOICE_TEMPLATE, cxt)
+        pdf_name = store_pdf(render_pdf(html_string))
+    _attach_pdf(invoice, key, pdf_name)
+
+
+def _render_invoice_streaming(invoice: Invoice, worklogs) -> None:
+    """
+    Render line items in chunks to a temporary HTML file and render that.
+
+    Only one chunk of line items is in memory at a time, and the renderer
+    reads the HTML and writes the PDF through files.
+    """
+    chunk_size = settings.INVOICE_STREAMING_CHUNK_SIZE
+    cxt = _invoice_context(invoice)
+    assets = invoice_assets().current()
+    key = RenderKey(cxt, assets.version)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        html_path = os.path.join(workdir, "invoice.html")
+        with open(html_path, "w", encoding="utf-8") as html_file:
+            html_file.write(assets.render(INVOICE_HEAD_TEMPLATE, cxt))
+            items = iter_line_items(worklogs, chunk_size=chunk_size)
+            while chunk := list(islice(items, chunk_size)):
+                for item in chunk:
+                    key.add_item(item)
+                html_file.write(
+                    assets.render(INVOICE_ITEMS_TEMPLATE, {"invoice_items": chunk})
+                )
+            html_file.write(assets.render(INVOICE_FOOT_TEMPLATE, cxt))
+
+        pdf_name = cached_pdf(key.hexdigest())
+        if pdf_name is None:
+            pdf_path = os.path.join(workdir, "invoice.pdf")
+            render_pdf_file(html_path, pdf_path)
+            pdf_name = store_pdf_file(pdf_path)
+    _attach_pdf(invoice, key.hexdigest(), pdf_name)
+
+
+def _set_job_stage(job_id, stage, **fields):
+    if job_id is not None:
+        InvoiceJob.objects.filter(id=job_id).update(
+            stage=stage, updated_at=timezone.now(), **fields
+        )
 
 
 @app.task
 def generate_invoice_task(
-    start_date: datetime, end_date: datetime, client_id: int
-) -> None:
-    worklogs = (
-        WorkLog.objects.filter(
-            billed_status=WorkLog.BillingStatus.UNBILLED,
-            date_logged__range=(start_date, end_date),
-            function__feature__project__client_id=client_id,
-        )
-        .order_by("function__feature__project__client")
-        .prefetch_related(
-            "function__feature__project",
-            "developer",
+    start_date: datetime,
+    end_date: datetime,
+    client_id: int,
+    job_id: int | None = None,
+) -> int | None:
+    try:
+        _set_job_stage(job_id, InvoiceJob.Stage.PRICING)
+        invoice = bill_client(
+            client_id=client_id,
+            start_date=start_date,
+            end_date=end_date,
         )
+        if invoice is not None:
+            _set_job_stage(job_id, InvoiceJob.Stage.RENDERING, invoice=invoice)
+            render_invoice(invoice)
+    except Exception as exc:
+        _set_job_stage(job_id, InvoiceJob.Stage.FAILED, error=str(exc))
+        raise
+    _set_job_stage(job_id, InvoiceJob.Stage.DONE)
+    return invoice and invoice.id
+
+
+def queue_invoice_job(*, requested_by, client, start_date, end_date):
+    """
+    Queue an invoice for a client and period unless one is already underway.
+
+    A request matching the admin, client and period of a job created within
+    `INVOICE_JOB_IDEMPOTENCY_WINDOW` seconds that has not failed returns that
+    job instead. Returns `(job, created)`.
+    """
+    idempotency_key = hashlib.sha256(
+        f"{requested_by.id}:{client.id}:{start_date}:{end_date}".encode("utf-8")
+    ).hexdigest()
+    window_start = timezone.now() - timedelta(
+        seconds=settings.INVOICE_JOB_IDEMPOTENCY_WINDOW
     )
-    grand_total = 0
-    invoice_items = []
-    for worklog in worklogs:
-        project = worklog.function.feature.project
-        developer_rate = ProjectRate.objects.get(
-            developer=worklog.developer,
-            project=project,
-        ).rate_per_hour
-        total_cost = worklog.hours_worked * developer_rate
-        grand_total += total_cost
-        invoice_items.append(
-            {
-                "project_title": project.title,
-                "description": worklog.function.description,
-                "hours": worklog.hours_worked,
-                "per_hour": developer_rate,
-                "cost": total_cost,
-            }
+    with transaction.atomic():
+        # Serialize concurrent requests for the same client.
+        User.objects.select_for_update().filter(id=client.id).exists()
+        job = (
+            InvoiceJob.objects.filter(
+                idempotency_key=idempotency_key,
+                created_at__gte=window_start,
+            )
+            .exclude(stage=InvoiceJob.Stage.FAILED)
+            .order_by("-created_at")
+            .first()
+        )
+        if job is not None:
+            return job, False
+
+        job = InvoiceJob.objects.create(
+            idempotency_key=idempotency_key,
+            requested_by=requested_by,
+            client=client,
+            start_date=start_date,
+            end_date=end_date,
+        )
+        transaction.on_commit(
+            lambda: generate_invoice_task.delay(
+                start_date, end_date, client.id, job_id=job.id
+            )
         )
+    return job, True
+
+
+@app.task
+def render_invoice_task(invoice_id: int) -> None:
+    render_invoice(Invoice.objects.get(id=invoice_id))
+
+
+@app.task
+def bill_client_task(start_date: datetime, end_date: datetime, client_id: int) -> dict:
+    """
+    Price and render one client's invoice as part of a billing run.
 
-    invoice = Invoice.objects.create(
-        client_id=client_id,
-        from_date=start_date,
-        to_date=end_date,
-        amount=0,
+    Failures are reported in the result instead of raised so that a single
+    client cannot keep the chord callback from recording the run.
+    """
+    try:
+        invoice_id = generate_invoice_task(start_date, end_date, client_id)
+    except Exception as exc:
+        logger.exception("Billing client %s failed", client_id)
+        return {"client_id": client_id, "invoice_id": None, "error": str(exc)}
+    return {"client_id": client_id, "invoice_id": invoice_id, "error": None}
+
+
+@app.task
+def dispatch_billing_run_task(billing_run_id: int) -> None:
+    billing_run = BillingRun.objects.get(id=billing_run_id)
+    client_ids = list(
+        clients_with_billable_worklogs(
+            start_date=billing_run.start_date,
+            end_date=billing_run.end_date,
+        )
     )
+    billing_run.status = BillingRun.Status.RUNNING
+    billing_run.client_count = len(client_ids)
+    billing_run.save(update_fields=["status", "client_count"])
 
-    logo_path = finders.find("images/logo.png")
-    if logo_path:
-        with open(logo_path, "rb") as logo_file:
-            image_base64 = base64.b64encode(logo_file.read()).decode("utf-8")
-    else:
-        image_base64 = ""
-
-    cxt = {
-        "logo_base64": image_base64,
-        "grand_total": grand_total,
-        "invoice_items": invoice_items,
-    }
+    if not client_ids:
+        finalize_billing_run_task([], billing_run_id)
+        return
 
-    html_string = render_to_string("invoices/invoice.html", cxt)
-    options = {
-        "page-size": "A4",
-        "encoding": "UTF-8",
-        "enable-local-file-access": "",
-    }
-    config = None
+    header = [
+        bill_client_task.s(billing_run.start_date, billing_run.end_date, client_id)
+        for client_id in client_ids
+    ]
+    chord(header)(finalize_billing_run_task.s(billing_run_id))
 
-    pdf_bytes = pdfkit.from_string(
-        html_string,
-        options=options,
-        configuration=config,
+
+@app.task
+def finalize_billing_run_task(results: list, billing_run_id: int) -> None:
+    invoice_ids = [result["invoice_id"] for result in results if result["invoice_id"]]
+    failed = [result for result in results if result["error"]]
+    total = Invoice.objects.filter(id__in=invoice_ids).aggregate(total=Sum("amount"))[
+        "total"
+    ]
+
+    billing_run = BillingRun.objects.get(id=billing_run_id)
+    billing_run.results = results
+    billing_run.invoice_count = len(invoice_ids)
+    billing_run.failed_count = len(failed)
+    billing_run.total_amount = total or 0
+    billing_run.status = (
+        BillingRun.Status.FAILED
+        if failed and not invoice_ids
+        else BillingRun.Status.COMPLETED
     )
-    pdf_io = BytesIO(pdf_bytes)
+    billing_run.finished_at = timezone.now()
+    billing_run.save()
 
-    invoice.pdf_file.save(f"{invoice.id}.pdf", pdf_io)
-    invoice.save()
+
+@app.task
+def reprice_functions_task(
+    project_id: int | None = None, developer_id: int | None = None
+) -> int:
+    return reprice_functions(project_id=project_id, developer_id=developer_id)
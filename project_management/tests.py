@@ -1,16 +1,78 @@
-from datetime import datetime
+import base64
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import skipUnless
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.template.loader import get_template
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
 from rest_framework.test import APITestCase
 
+from core import response_cache
+from core.checks import check_shared_cache
+from project_management.assets import INVOICE_TEMPLATE, RenderAssets
+from project_management.billing import (
+    bill_client,
+    billable_worklogs,
+    clients_with_billable_worklogs,
+    grand_total,
+    iter_line_items,
+)
 from project_management.factories import (
     FeatureFactory,
     FunctionFactory,
     ProjectFactory,
+    ProjectRateFactory,
     UserFactory,
     WorkLogFactory,
 )
-from project_management.models import Project
+from project_management.filters import WorkLogFilter
+from project_management.membership import visible_project_ids
+from project_management.models import (
+    BillingRun,
+    Feature,
+    Function,
+    Invoice,
+    InvoiceJob,
+    Project,
+    ProjectRate,
+    WorkLog,
+)
+from project_management.rates import get_rate, get_rates, reprice_functions
+from project_management.render_cache import render_key, store_pdf
+from project_management.rendering import BaseRenderer, PooledRenderer, get_renderer
+from project_management.rollups import FunctionCompleted
+from project_management.tasks import (
+    dispatch_billing_run_task,
+    finalize_billing_run_task,
+    generate_invoice_task,
+    render_invoice,
+    render_invoice_task,
+)
+from project_management.timesheets import review_work_logs
+from project_management.viewsets import (
+    FeatureViewSet,
+    FunctionViewSet,
+    InvoiceViewSet,
+    ProjectViewSet,
+    WorkLogViewSet,
+)
 
 User = get_user_model()
 
@@ -18,6 +80,7 @@ User = get_user_model()
 class ProjectTests(APITestCase):
     def setUp(self):
         super().setUp()
+        cache.clear()
         self.user = UserFactory(role=User.Role.ADMIN)
         self.client.force_authenticate(user=self.user)
 
@@ -60,6 +123,7 @@ class ProjectTests(APITestCase):
 
     def test_invoice_generation_by_client(self):
         client = UserFactory(role=User.Role.CLIENT)
+        self.client.force_authenticate(user=client)
         url = "/api/projects/generate_invoice/"
         request_data = {
             "start_date": "2024-01-01",
@@ -69,3 +133,1582 @@ class ProjectTests(APITestCase):
         response = self.client.post(url, request_data)
         print(response.data)
         self.assertEqual(response.status_code, 403)
+
+
+class BillingEngineTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client_user = UserFactory(role=User.Role.CLIENT)
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.project = ProjectFactory(
+            client=self.client_user, developers=[self.developer]
+        )
+        ProjectRateFactory(project=self.project, developer=self.developer, rate=50)
+        self.function = FunctionFactory(
+            feature=FeatureFactory(project=self.project),
+            developer=self.developer,
+            estimated_time=100,
+        )
+        self.today = date.today()
+
+    def _worklogs(self):
+        return billable_worklogs(
+            client_id=self.client_user.id,
+            start_date=self.today,
+            end_date=self.today,
+        )
+
+    def test_line_items_are_grouped_by_project_and_developer(self):
+        WorkLogFactory(function=self.function, developer=self.developer, hours_worked=2)
+        WorkLogFactory(function=self.function, developer=self.developer, hours_worked=3)
+
+        items = list(iter_line_items(self._worklogs()))
+
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]["hours"], Decimal("5"))
+        self.assertEqual(items[0]["per_hour"], Decimal("50"))
+        self.assertEqual(items[0]["cost"], Decimal("250"))
+        self.assertEqual(grand_total(self._worklogs()), Decimal("250"))
+
+    def test_detail_line_items_and_missing_rate(self):
+        other_developer = UserFactory(role=User.Role.DEVELOPER)
+        WorkLogFactory(function=self.function, developer=self.developer, hours_worked=2)
+        WorkLogFactory(
+            function=self.function, developer=other_developer, hours_worked=4
+        )
+
+        items = list(iter_line_items(self._worklogs(), detail=True))
+
+        self.assertEqual(len(items), 2)
+        self.assertEqual(
+            sorted(item["cost"] for item in items), [Decimal("0"), Decimal("100")]
+        )
+        self.assertEqual(grand_total(self._worklogs()), Decimal("100"))
+
+    def test_query_count_does_not_grow_with_worklogs(self):
+        WorkLogFactory.create_batch(
+            20, function=self.function, developer=self.developer, hours_worked=1
+        )
+        with self.assertNumQueries(2):
+            list(iter_line_items(self._worklogs(), detail=True))
+            grand_total(self._worklogs())
+        self.assertEqual(
+            WorkLog.objects.filter(
+                billed_status=WorkLog.BillingStatus.UNBILLED
+            ).count(),
+            20,
+        )
+
+    def test_bill_client_claims_worklogs_once(self):
+        WorkLogFactory(function=self.function, developer=self.developer, hours_worked=2)
+        WorkLogFactory(function=self.function, developer=self.developer, hours_worked=1)
+
+        invoice = bill_client(
+            client_id=self.client_user.id,
+            start_date=self.today,
+            end_date=self.today,
+        )
+
+        self.assertEqual(invoice.amount, Decimal("150"))
+        self.assertEqual(
+            set(invoice.work_logs.values_list("billed_status", flat=True)),
+            {WorkLog.BillingStatus.BILLED},
+        )
+        self.assertEqual(invoice.work_logs.filter(billed_date=self.today).count(), 2)
+        self.assertIsNone(
+            bill_client(
+                client_id=self.client_user.id,
+                start_date=self.today,
+                end_date=self.today,
+            )
+        )
+
+
+class InvoicePreviewTests(APITestCase):
+    url = "/api/projects/invoices/preview/"
+
+    def setUp(self):
+        super().setUp()
+        self.user = UserFactory(role=User.Role.ADMIN)
+        self.client.force_authenticate(user=self.user)
+
+    def test_preview_prices_worklogs_without_invoicing(self):
+        developer = UserFactory(role=User.Role.DEVELOPER)
+        function = FunctionFactory(developer=developer)
+        project = function.feature.project
+        ProjectRateFactory(project=project, developer=developer, rate=40)
+        WorkLogFactory(function=function, developer=developer, hours_worked=2)
+        WorkLogFactory(function=function, developer=developer, hours_worked=3)
+        today = date.today().isoformat()
+        params = {"client": project.client_id, "start_date": today, "end_date": today}
+
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url, params)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["grand_total"], "200.00")
+        self.assertEqual(len(response.data["line_items"]), 1)
+        self.assertEqual(response.data["projects"][0]["cost"], "200.00")
+        self.assertFalse(Invoice.objects.exists())
+
+        response = self.client.get(self.url, {**params, "detail": "true"})
+        self.assertEqual(len(response.data["line_items"]), 2)
+
+    def test_preview_requires_admin(self):
+        client = UserFactory(role=User.Role.CLIENT)
+        self.client.force_authenticate(user=client)
+        today = date.today().isoformat()
+        response = self.client.get(
+            self.url, {"client": client.id, "start_date": today, "end_date": today}
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class BillingRunTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = UserFactory(role=User.Role.ADMIN)
+        self.client.force_authenticate(user=self.user)
+
+    def test_create_billing_run(self):
+        url = "/api/projects/billing-runs/"
+        response = self.client.post(
+            url, {"start_date": "2024-01-01", "end_date": "2024-01-31"}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["status"], BillingRun.Status.PENDING)
+        self.assertEqual(response.data["requested_by"], self.user.id)
+
+    def test_billing_run_requires_admin(self):
+        self.client.force_authenticate(user=UserFactory(role=User.Role.CLIENT))
+        url = "/api/projects/billing-runs/"
+        response = self.client.post(
+            url, {"start_date": "2024-01-01", "end_date": "2024-01-31"}
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_clients_with_billable_worklogs(self):
+        worklog = WorkLogFactory()
+        WorkLogFactory(billed_status=WorkLog.BillingStatus.BILLED)
+        today = date.today()
+        client_ids = clients_with_billable_worklogs(start_date=today, end_date=today)
+        self.assertEqual(list(client_ids), [worklog.function.feature.project.client_id])
+
+    def test_run_without_clients_completes(self):
+        billing_run = BillingRun.objects.create(
+            start_date=date(2024, 1, 1), end_date=date(2024, 1, 31)
+        )
+        dispatch_billing_run_task(billing_run.id)
+        billing_run.refresh_from_db()
+        self.assertEqual(billing_run.status, BillingRun.Status.COMPLETED)
+        self.assertEqual(billing_run.client_count, 0)
+
+    def test_finalize_records_summary(self):
+        billing_run = BillingRun.objects.create(
+            start_date=date(2024, 1, 1), end_date=date(2024, 1, 31)
+        )
+        client = UserFactory(role=User.Role.CLIENT)
+        invoice = client.invoices.create(amount=Decimal("120.50"))
+        results = [
+            {"client_id": client.id, "invoice_id": invoice.id, "error": None},
+            {"client_id": 0, "invoice_id": None, "error": "boom"},
+        ]
+        finalize_billing_run_task(results, billing_run.id)
+        billing_run.refresh_from_db()
+        self.assertEqual(billing_run.status, BillingRun.Status.COMPLETED)
+        self.assertEqual(billing_run.invoice_count, 1)
+        self.assertEqual(billing_run.failed_count, 1)
+        self.assertEqual(billing_run.total_amount, Decimal("120.50"))
+
+
+ECHO_RENDERER = """
+import struct, sys
+stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+while True:
+    header = stdin.read(4)
+    if not header:
+        break
+    html = stdin.read(struct.unpack(">I", header)[0])
+    if html == b"fail":
+        body = b"cannot render"
+        stdout.write(struct.pack(">B", 1) + struct.pack(">I", len(body)) + body)
+    else:
+        body = b"%PDF" + html
+        stdout.write(struct.pack(">B", 0) + struct.pack(">I", len(body)) + body)
+    stdout.flush()
+"""
+
+
+class StaticRenderer(BaseRenderer):
+    def render(self, html):
+        return b"fallback"
+
+
+class PooledRendererTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.renderer = PooledRenderer(
+            command=[sys.executable, "-c", ECHO_RENDERER],
+            size=1,
+            max_documents=2,
+            timeout=10,
+            fallback=StaticRenderer(),
+        )
+        self.addCleanup(self.renderer.close)
+
+    def test_processes_are_reused_and_recycled(self):
+        for _ in range(3):
+            self.assertEqual(self.renderer.render("<p>hi</p>"), b"%PDF<p>hi</p>")
+
+        stats = self.renderer.stats()
+        self.assertEqual(stats["documents"], 3)
+        self.assertEqual(stats["spawned"], 2)
+        self.assertEqual(stats["recycled"], 1)
+
+    def test_render_file_streams_through_the_pool(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        html_path = os.path.join(workdir, "invoice.html")
+        pdf_path = os.path.join(workdir, "invoice.pdf")
+        with open(html_path, "w") as html_file:
+            html_file.write("<p>streamed</p>" * 10000)
+
+        self.renderer.render_file(html_path, pdf_path)
+
+        with open(pdf_path, "rb") as pdf_file:
+            self.assertEqual(pdf_file.read(), b"%PDF" + b"<p>streamed</p>" * 10000)
+
+    def test_failed_render_falls_back(self):
+        self.assertEqual(self.renderer.render("fail"), b"fallback")
+
+        stats = self.renderer.stats()
+        self.assertEqual(stats["failures"], 1)
+        self.assertEqual(stats["fallbacks"], 1)
+
+    def test_without_command_uses_fallback(self):
+        renderer = PooledRenderer(fallback=StaticRenderer())
+        self.assertEqual(renderer.render("<p>hi</p>"), b"fallback")
+
+    def test_stalled_renderer_times_out_while_writing(self):
+        renderer = PooledRenderer(
+            command=[sys.executable, "-c", "import time; time.sleep(2)"],
+            timeout=0.5,
+            fallback=StaticRenderer(),
+        )
+        self.addCleanup(renderer.close)
+        started = time.monotonic()
+        self.assertEqual(renderer.render("x" * 2**20), b"fallback")
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(renderer.stats()["failures"], 1)
+
+    def test_missing_command_falls_back(self):
+        renderer = PooledRenderer(
+            command=["/nonexistent/renderer"], fallback=StaticRenderer()
+        )
+        self.addCleanup(renderer.close)
+        self.assertEqual(renderer.render("<p>hi</p>"), b"fallback")
+        self.assertEqual(renderer.stats()["failures"], 1)
+
+
+class CountingRenderer(BaseRenderer):
+    def render(self, html):
+        self._count(documents=1)
+        return b"%PDF-" + html.encode("utf-8")
+
+
+class FileCountingRenderer(CountingRenderer):
+    def render_file(self, html_path, pdf_path):
+        self._count(files=1)
+        super().render_file(html_path, pdf_path)
+
+
+class RenderCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrides = override_settings(
+            MEDIA_ROOT=media_root,
+            PDF_RENDERER={"BACKEND": "project_management.tests.CountingRenderer"},
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_render_key_is_stable_and_content_sensitive(self):
+        context = {"grand_total": Decimal("10.0"), "from_date": date(2024, 1, 1)}
+        same = {"from_date": date(2024, 1, 1), "grand_total": Decimal("10.00")}
+        changed = {"grand_total": Decimal("11"), "from_date": date(2024, 1, 1)}
+
+        self.assertEqual(render_key(context, "v1"), render_key(same, "v1"))
+        self.assertNotEqual(render_key(context, "v1"), render_key(changed, "v1"))
+        self.assertNotEqual(render_key(context, "v1"), render_key(context, "v2"))
+
+    def test_identical_pdfs_share_one_file(self):
+        self.assertEqual(store_pdf(b"%PDF-same"), store_pdf(b"%PDF-same"))
+        self.assertNotEqual(store_pdf(b"%PDF-same"), store_pdf(b"%PDF-other"))
+
+    def test_rerendered_invoice_reuses_rendered_pdf(self):
+        worklog = WorkLogFactory()
+        client_id = worklog.function.feature.project.client_id
+        today = date.today()
+
+        invoice = Invoice.objects.get(id=generate_invoice_task(today, today, client_id))
+        pdf_name = invoice.pdf_file.name
+        render_invoice_task(invoice.id)
+        invoice.refresh_from_db()
+
+        self.assertEqual(invoice.pdf_file.name, pdf_name)
+        self.assertEqual(get_renderer().stats()["documents"], 1)
+
+    @override_settings(
+        INVOICE_STREAMING_THRESHOLD=2,
+        PDF_RENDERER={"BACKEND": "project_management.tests.FileCountingRenderer"},
+    )
+    def test_streaming_is_decided_by_line_items(self):
+        function = FunctionFactory()
+        developer = function.developer
+        ProjectRateFactory(project=function.feature.project, developer=developer)
+        for _ in range(5):
+            WorkLogFactory(function=function, developer=developer)
+        today = date.today()
+        invoice = bill_client(
+            client_id=function.feature.project.client_id,
+            start_date=today,
+            end_date=today,
+        )
+
+        render_invoice(invoice)
+        self.assertEqual(get_renderer().stats().get("files", 0), 0)
+
+    @override_settings(INVOICE_STREAMING_CHUNK_SIZE=2)
+    def test_streamed_render_matches_in_memory_render(self):
+        function = FunctionFactory()
+        project = function.feature.project
+        for _ in range(5):
+            developer = UserFactory(role=User.Role.DEVELOPER)
+            ProjectRateFactory(project=project, developer=developer)
+            WorkLogFactory(function=function, developer=developer)
+        today = date.today()
+        invoice = bill_client(
+            client_id=project.client_id, start_date=today, end_date=today
+        )
+
+        render_invoice(invoice, stream=True)
+        invoice.refresh_from_db()
+        streamed_key = invoice.render_key
+        with invoice.pdf_file.open("rb") as pdf_file:
+            html = pdf_file.read().decode("utf-8")
+        self.assertEqual(html.count('<tr class="item">'), 5)
+        self.assertIn("Grand Total:", html)
+        self.assertIn(
+            f"<title>Invoice {today:%Y-%m-%d} to {today:%Y-%m-%d}</title>", html
+        )
+
+        render_invoice(invoice, stream=False)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.render_key, streamed_key)
+        self.assertEqual(get_renderer().stats()["documents"], 1)
+
+
+class RenderAssetsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        self.css_path = os.path.join(static_root, "invoice.css")
+        with open(self.css_path, "w") as css_file:
+            css_file.write("body { color: black; }")
+        overrides = override_settings(STATICFILES_DIRS=[static_root])
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_assets_are_encoded_once_and_reloaded_on_change(self):
+        assets = RenderAssets([INVOICE_TEMPLATE], {"css": "invoice.css"}, 0)
+        assets.current()
+        version = assets.version
+        self.assertEqual(
+            base64.b64decode(assets.context["css"]), b"body { color: black; }"
+        )
+
+        self.assertIs(assets.current(), assets)
+        self.assertEqual(assets.version, version)
+
+        with open(self.css_path, "w") as css_file:
+            css_file.write("body { color: red; }")
+        stat = os.stat(self.css_path)
+        os.utime(self.css_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        assets.current()
+        self.assertNotEqual(assets.version, version)
+        self.assertEqual(
+            base64.b64decode(assets.context["css"]), b"body { color: red; }"
+        )
+
+    def test_edited_templates_are_recompiled(self):
+        template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, template_dir)
+        part_path = os.path.join(template_dir, "part.html")
+        with open(os.path.join(template_dir, "page.html"), "w") as page_file:
+            page_file.write('<p>{% include "part.html" %}</p>')
+        with open(part_path, "w") as part_file:
+            part_file.write("{{ total }} old")
+        overrides = override_settings(
+            TEMPLATES=[
+                {
+                    "BACKEND": "django.template.backends.django.DjangoTemplates",
+                    "DIRS": [template_dir],
+                }
+            ]
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        assets = RenderAssets(["page.html", "part.html"], {}, 0).current()
+        version = assets.version
+        self.assertEqual(assets.render("page.html", {"total": 1}), "<p>1 old</p>")
+        # Warm Django's cached loader, which never notices the edit below.
+        get_template("part.html")
+
+        with open(part_path, "w") as part_file:
+            part_file.write("{{ total }} new")
+        stat = os.stat(part_path)
+        os.utime(part_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        assets.current()
+        self.assertNotEqual(assets.version, version)
+        self.assertEqual(assets.render("page.html", {"total": 1}), "<p>1 new</p>")
+        self.assertEqual(get_template("part.html").render({"total": 1}), "1 old")
+
+
+class InvoiceJobTests(APITestCase):
+    url = "/api/projects/generate_invoice/"
+
+    def setUp(self):
+        super().setUp()
+        self.user = UserFactory(role=User.Role.ADMIN)
+        self.client.force_authenticate(user=self.user)
+        self.client_user = UserFactory(role=User.Role.CLIENT)
+        self.request_data = {
+            "start_date": "2024-01-01",
+            "end_date": "2024-01-31",
+            "client": self.client_user.id,
+        }
+
+    def test_repeated_request_returns_existing_job(self):
+        first = self.client.post(self.url, self.request_data)
+        second = self.client.post(self.url, self.request_data)
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(first.data["id"], second.data["id"])
+        self.assertEqual(first.data["stage"], InvoiceJob.Stage.QUEUED)
+
+        other_period = {**self.request_data, "end_date": "2024-02-29"}
+        third = self.client.post(self.url, other_period)
+        self.assertEqual(third.status_code, 201)
+        self.assertNotEqual(third.data["id"], first.data["id"])
+
+    def test_failed_job_is_not_reused(self):
+        first = self.client.post(self.url, self.request_data)
+        InvoiceJob.objects.filter(id=first.data["id"]).update(
+            stage=InvoiceJob.Stage.FAILED
+        )
+        second = self.client.post(self.url, self.request_data)
+        self.assertEqual(second.status_code, 201)
+        self.assertNotEqual(first.data["id"], second.data["id"])
+
+    def test_job_status_reports_stage(self):
+        job_id = self.client.post(self.url, self.request_data).data["id"]
+        generate_invoice_task(
+            date(2024, 1, 1), date(2024, 1, 31), self.client_user.id, job_id
+        )
+
+        response = self.client.get(f"/api/projects/invoice-jobs/{job_id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["stage"], InvoiceJob.Stage.DONE)
+        self.assertIsNone(response.data["invoice"])
+
+
+class InvoiceDownloadTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrides = override_settings(MEDIA_ROOT=media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.client_user = UserFactory(role=User.Role.CLIENT)
+        self.invoice = Invoice.objects.create(
+            client=self.client_user, amount=Decimal("10")
+        )
+        self.invoice.pdf_file.name = store_pdf(b"%PDF-0123456789")
+        self.invoice.save()
+        self.url = f"/api/projects/invoices/{self.invoice.id}/download/"
+        self.client.force_authenticate(user=self.client_user)
+
+    def test_download_full_and_range(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-0123456789")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=5-9")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b"01234")
+        self.assertEqual(response["Content-Range"], "bytes 5-9/15")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=99-")
+        self.assertEqual(response.status_code, 416)
+
+    def test_download_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(SENDFILE_BACKEND="x-accel-redirect")
+    def test_download_is_offloaded(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            f"/protected-media/{self.invoice.pdf_file.name}",
+        )
+        self.assertEqual(response.content, b"")
+
+    def test_pdfs_are_not_exposed_as_media(self):
+        response = self.client.get(f"/api/projects/invoices/{self.invoice.id}/")
+        self.assertNotIn("pdf_file", response.data)
+        self.assertNotIn("render_key", response.data)
+        self.assertTrue(response.data["download_url"].endswith(self.url))
+
+        response = self.client.get(f"/media/{self.invoice.pdf_file.name}")
+        self.assertEqual(response.status_code, 404)
+
+    def test_download_checks_ownership(self):
+        self.client.force_authenticate(user=UserFactory(role=User.Role.CLIENT))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+
+class RollupTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.feature = FeatureFactory()
+        self.project = self.feature.project
+        ProjectRateFactory(project=self.project, developer=self.developer, rate=10)
+
+    def assertRollups(self, obj, cost, estimated_time):
+        obj.refresh_from_db()
+        self.assertEqual(obj.total_cost, Decimal(cost))
+        self.assertEqual(obj.total_estimated_time, Decimal(estimated_time))
+
+    def test_function_writes_maintain_rollups(self):
+        function = FunctionFactory(
+            feature=self.feature, developer=self.developer, estimated_time=5
+        )
+        FunctionFactory(
+            feature=self.feature, developer=self.developer, estimated_time=2
+        )
+        self.assertRollups(self.feature, "70", "7")
+        self.assertRollups(self.project, "70", "7")
+
+        function.estimated_time = 1
+        function.save()
+        self.assertRollups(self.feature, "30", "3")
+        self.assertRollups(self.project, "30", "3")
+
+        other_feature = FeatureFactory(project=self.project)
+        function.feature = other_feature
+        function.save()
+        self.assertRollups(self.feature, "20", "2")
+        self.assertRollups(other_feature, "10", "1")
+        self.assertRollups(self.project, "30", "3")
+
+        function.delete()
+        self.assertRollups(other_feature, "0", "0")
+        self.assertRollups(self.project, "20", "2")
+
+    def test_moving_a_feature_moves_its_rollup(self):
+        FunctionFactory(
+            feature=self.feature, developer=self.developer, estimated_time=4
+        )
+        other_project = ProjectFactory()
+        self.feature.refresh_from_db()
+        self.feature.project = other_project
+        self.feature.save()
+        self.assertRollups(self.project, "0", "0")
+        self.assertRollups(other_project, "40", "4")
+
+    def test_stale_instance_does_not_overwrite_rollup(self):
+        stale_feature = Feature.objects.get(id=self.feature.id)
+        FunctionFactory(
+            feature=self.feature, developer=self.developer, estimated_time=3
+        )
+        stale_feature.title = "Renamed"
+        stale_feature.save()
+        self.assertRollups(self.feature, "30", "3")
+
+    def test_rebuild_and_verify(self):
+        FunctionFactory(
+            feature=self.feature, developer=self.developer, estimated_time=3
+        )
+        Feature.objects.filter(id=self.feature.id).update(total_cost=0)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_rollups", "--verify", stdout=StringIO())
+
+        call_command("rebuild_rollups", stdout=StringIO())
+        self.assertRollups(self.feature, "30", "3")
+        self.assertRollups(self.project, "30", "3")
+
+
+class RateResolutionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.project = ProjectFactory()
+        self.rates = ProjectRateFactory.create_batch(3, project=self.project, rate=25)
+
+    def test_get_rates_resolves_pairs_in_one_query(self):
+        pairs = [(rate.project_id, rate.developer_id) for rate in self.rates]
+        pairs.append((self.project.id, UserFactory(role=User.Role.DEVELOPER).id))
+
+        with self.assertNumQueries(1):
+            rates = get_rates(pairs)
+        self.assertEqual(
+            sorted(rates.values()),
+            [Decimal("0"), Decimal("25"), Decimal("25"), Decimal("25")],
+        )
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_rates(pairs), rates)
+
+    def test_rate_changes_invalidate_the_cache(self):
+        project_rate = self.rates[0]
+        pair = {
+            "project_id": self.project.id,
+            "developer_id": project_rate.developer_id,
+        }
+        self.assertEqual(get_rate(**pair), Decimal("25"))
+
+        project_rate.rate = 40
+        project_rate.save()
+        self.assertEqual(get_rate(**pair), Decimal("40"))
+
+        project_rate.delete()
+        self.assertEqual(get_rate(**pair), Decimal("0"))
+
+    def test_function_save_uses_cached_rate(self):
+        project_rate = self.rates[0]
+        function = FunctionFactory(
+            feature=FeatureFactory(project=self.project),
+            developer=project_rate.developer,
+            estimated_time=2,
+        )
+        self.assertEqual(function.cost, Decimal("50"))
+
+
+class RepricingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.feature = FeatureFactory()
+        self.project_rate = ProjectRateFactory(project=self.feature.project, rate=10)
+        self.functions = FunctionFactory.create_batch(
+            3,
+            feature=self.feature,
+            developer=self.project_rate.developer,
+            estimated_time=2,
+        )
+        self.other = FunctionFactory(
+            developer=self.project_rate.developer, estimated_time=2
+        )
+
+    def test_rate_change_queues_repricing(self):
+        self.project_rate.rate = 15
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.project_rate.save()
+        self.assertEqual(len(callbacks), 2)
+
+    def test_reprice_updates_costs_history_and_rollups(self):
+        ProjectRate.objects.filter(id=self.project_rate.id).update(rate=15)
+        history_count = Function.history.count()
+
+        with self.assertNumQueries(8):
+            repriced = reprice_functions(
+                project_id=self.feature.project_id,
+                developer_id=self.project_rate.developer_id,
+            )
+
+        self.assertEqual(repriced, 3)
+        for function in self.functions:
+            function.refresh_from_db()
+            self.assertEqual(function.cost, Decimal("30"))
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.cost, Decimal("0"))
+        self.assertEqual(Function.history.count(), history_count + 3)
+        self.feature.refresh_from_db()
+        self.assertEqual(self.feature.total_cost, Decimal("90"))
+
+        self.assertEqual(reprice_functions(project_id=self.feature.project_id), 0)
+
+    def test_reprice_command(self):
+        ProjectRate.objects.filter(id=self.project_rate.id).delete()
+        out = StringIO()
+        call_command("reprice_functions", stdout=out)
+        self.assertIn("Repriced 3 functions", out.getvalue())
+
+
+class LoggedHoursTests(APITestCase):
+    url = "/api/projects/worklogs/"
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.client.force_authenticate(user=self.developer)
+        self.function = FunctionFactory(developer=self.developer, estimated_time=5)
+
+    def log(self, hours):
+        return self.client.post(
+            self.url,
+            {"function": self.function.id, "hours_worked": hours, "description": "x"},
+        )
+
+    def assertLoggedHours(self, hours):
+        self.function.refresh_from_db()
+        self.assertEqual(self.function.logged_hours, Decimal(hours))
+
+    def test_create_is_refused_once_the_estimate_is_reached(self):
+        self.assertEqual(self.log(3).status_code, 201)
+        self.assertEqual(self.log(3).status_code, 201)
+        self.assertLoggedHours("6")
+
+        response = self.log(1)
+        self.assertEqual(response.status_code, 400)
+        self.assertLoggedHours("6")
+        self.assertEqual(self.function.work_logs.count(), 2)
+
+    def test_guarded_update_rejects_a_stale_check(self):
+        Function.objects.filter(id=self.function.id).update(logged_hours=5)
+        work_log = WorkLog(
+            function=self.function, developer=self.developer, hours_worked=1
+        )
+        with self.assertRaises(FunctionCompleted):
+            work_log.save(check_estimate=True)
+        self.assertFalse(WorkLog.objects.exists())
+
+    def test_function_without_estimate_is_unbounded(self):
+        Function.objects.filter(id=self.function.id).update(
+            estimated_time=None, logged_hours=100
+        )
+        self.assertEqual(self.log(8).status_code, 201)
+        self.assertLoggedHours("108")
+
+    def test_edits_and_deletes_adjust_logged_hours(self):
+        work_log = WorkLogFactory(function=self.function, hours_worked=2)
+        WorkLogFactory(function=self.function, hours_worked=1)
+        self.assertLoggedHours("3")
+
+        work_log.hours_worked = 4
+        work_log.save()
+        self.assertLoggedHours("5")
+
+        other = FunctionFactory()
+        work_log.function = other
+        work_log.save()
+        self.assertLoggedHours("1")
+        other.refresh_from_db()
+        self.assertEqual(other.logged_hours, Decimal("4"))
+
+        work_log.delete()
+        other.refresh_from_db()
+        self.assertEqual(other.logged_hours, Decimal("0"))
+
+    def test_rebuild_restores_logged_hours(self):
+        WorkLogFactory(function=self.function, hours_worked=2)
+        Function.objects.filter(id=self.function.id).update(logged_hours=0)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_rollups", "--verify", stdout=StringIO())
+        call_command("rebuild_rollups", stdout=StringIO())
+        self.assertLoggedHours("2")
+
+
+class BulkWorkLogTests(APITestCase):
+    url = "/api/projects/worklogs/bulk/"
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.client.force_authenticate(user=self.developer)
+        self.functions = FunctionFactory.create_batch(3, estimated_time=8)
+
+    def entries(self, count, hours=1):
+        return [
+            {
+                "function": self.functions[index % 3].id,
+                "hours_worked": str(hours),
+                "description": f"Day {index}",
+            }
+            for index in range(count)
+        ]
+
+    def test_bulk_create_inserts_entries_and_history(self):
+        with self.assertNumQueries(6):
+            response = self.client.post(
+                self.url, {"entries": self.entries(21)}, format="json"
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 21)
+        self.assertEqual(WorkLog.objects.filter(developer=self.developer).count(), 21)
+        self.assertEqual(WorkLog.history.count(), 21)
+        for function in self.functions:
+            function.refresh_from_db()
+            self.assertEqual(function.logged_hours, Decimal("7"))
+
+    def test_bulk_create_reports_errors_per_row(self):
+        entries = self.entries(2, hours=8) + self.entries(2)
+        entries.append({"function": 0, "hours_worked": "1", "description": "x"})
+        response = self.client.post(self.url, {"entries": entries}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.data["entries"]
+        self.assertEqual(sorted(errors), [2, 3, 4])
+        for error in errors.values():
+            self.assertIn("function", error)
+        self.assertFalse(WorkLog.objects.exists())
+        self.functions[0].refresh_from_db()
+        self.assertEqual(self.functions[0].logged_hours, Decimal("0"))
+
+    def test_bulk_create_validates_fields_per_row(self):
+        entries = self.entries(2)
+        entries[1]["hours_worked"] = "not a number"
+        response = self.client.post(self.url, {"entries": entries}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data["entries"]), [1])
+        self.assertIn("hours_worked", response.data["entries"][1])
+
+
+class BulkReviewTests(APITestCase):
+    url = "/api/projects/worklogs/bulk-review/"
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.admin = UserFactory(role=User.Role.ADMIN)
+        self.client.force_authenticate(user=self.admin)
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.work_logs = WorkLogFactory.create_batch(4, developer=self.developer)
+        self.other = WorkLogFactory()
+
+    def test_review_by_ids(self):
+        ids = [work_log.id for work_log in self.work_logs[:2]]
+        WorkLog.objects.filter(id=ids[1]).update(status=WorkLog.Status.APPROVED)
+        history_count = WorkLog.history.count()
+
+        response = self.client.post(
+            self.url,
+            {"ids": ids, "decision": "rejected", "reason": "Duplicate"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data, {"decision": "rejected", "reviewed": 1, "skipped": 1}
+        )
+        work_log = WorkLog.objects.get(id=ids[0])
+        self.assertEqual(work_log.status, WorkLog.Status.REJECTED)
+        self.assertEqual(work_log.reason, "Duplicate")
+        self.assertEqual(WorkLog.history.count(), history_count + 1)
+        self.assertEqual(
+            WorkLog.history.latest("history_id").history_user_id, self.admin.id
+        )
+
+    def test_review_by_filter(self):
+        response = self.client.post(
+            self.url,
+            {"filter": {"developer": self.developer.id}, "decision": "approved"},
+            format="json",
+        )
+        self.assertEqual(response.data, {"decision": "approved", "reviewed": 4})
+        self.assertEqual(
+            WorkLog.objects.filter(status=WorkLog.Status.APPROVED).count(), 4
+        )
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.status, WorkLog.Status.REVIEW)
+
+    def test_ids_or_filter_is_required(self):
+        response = self.client.post(self.url, {"decision": "approved"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_empty_or_unknown_filters_are_rejected(self):
+        for review_filter in ({}, {"projct": 1}):
+            response = self.client.post(
+                self.url,
+                {"filter": review_filter, "decision": "approved"},
+                format="json",
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("filter", response.data)
+        self.assertFalse(
+            WorkLog.objects.filter(status=WorkLog.Status.APPROVED).exists()
+        )
+
+    def test_only_admins_can_review(self):
+        self.client.force_authenticate(user=self.developer)
+        response = self.client.post(
+            self.url,
+            {"ids": [self.work_logs[0].id], "decision": "approved"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class TimesheetTests(APITestCase):
+    url = "/api/projects/worklogs/timesheet/"
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.admin = UserFactory(role=User.Role.ADMIN)
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.function = FunctionFactory()
+        self.other_function = FunctionFactory()
+        for day, hours in ((1, 2), (2, 3), (9, 4)):
+            work_log = WorkLogFactory(
+                function=self.function, developer=self.developer, hours_worked=hours
+            )
+            WorkLog.objects.filter(id=work_log.id).update(
+                date_logged=date(2024, 1, day)
+            )
+        WorkLog.objects.filter(hours_worked=3).update(status=WorkLog.Status.APPROVED)
+        WorkLogFactory(function=self.other_function, hours_worked=1)
+
+    def test_hours_by_week_with_breakdowns(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(
+            self.url, {"developer": self.developer.id, "end_date": "2024-12-31"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row["period"], row["hours"]) for row in response.data],
+            [("2024-01-01", "5.00"), ("2024-01-08", "4.00")],
+        )
+        first = response.data[0]
+        self.assertEqual(first["project_id"], self.function.feature.project_id)
+        self.assertEqual(first["status"]["approved"], "3.00")
+        self.assertEqual(first["status"]["review"], "2.00")
+        self.assertEqual(first["billed_status"]["unbilled"], "5.00")
+
+        response = self.client.get(
+            self.url, {"developer": self.developer.id, "period": "month"}
+        )
+        self.assertEqual(
+            [(row["period"], row["hours"]) for row in response.data],
+            [("2024-01-01", "9.00")],
+        )
+
+    def test_role_scoping(self):
+        self.client.force_authenticate(user=self.developer)
+        response = self.client.get(self.url)
+        self.assertEqual(
+            {row["developer_id"] for row in response.data}, {self.developer.id}
+        )
+
+        self.client.force_authenticate(user=self.other_function.feature.project.client)
+        response = self.client.get(self.url)
+        self.assertEqual(
+            [row["project_id"] for row in response.data],
+            [self.other_function.feature.project_id],
+        )
+
+    def test_results_are_cached_until_worklogs_change(self):
+        self.client.force_authenticate(user=self.developer)
+        first = self.client.get(self.url).data
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).data, first)
+
+        WorkLogFactory(function=self.function, developer=self.developer, hours_worked=1)
+        self.assertEqual(len(self.client.get(self.url).data), len(first) + 1)
+
+    def test_invalid_filters_are_rejected(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(self.url, {"project": 99999})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("project", response.data)
+
+    def test_project_and_developer_changes_invalidate_cached_rows(self):
+        project = self.function.feature.project
+        old_client = project.client
+        new_client = UserFactory(role=User.Role.CLIENT)
+        self.client.force_authenticate(user=old_client)
+        self.assertEqual(len(self.client.get(self.url).data), 2)
+        self.client.force_authenticate(user=new_client)
+        self.assertEqual(self.client.get(self.url).data, [])
+
+        project.client = new_client
+        project.title = "Renamed"
+        project.save()
+        response = self.client.get(self.url)
+        self.assertEqual({row["project_title"] for row in response.data}, {"Renamed"})
+        self.client.force_authenticate(user=old_client)
+        self.assertEqual(self.client.get(self.url).data, [])
+
+        self.developer.first_name, self.developer.last_name = "Ada", "Lovelace"
+        self.developer.save(update_fields=["first_name", "last_name"])
+        self.client.force_authenticate(user=new_client)
+        response = self.client.get(self.url)
+        self.assertEqual(
+            {row["developer_name"] for row in response.data}, {"Ada Lovelace"}
+        )
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.client.force_authenticate(user=self.developer)
+        WorkLogFactory.create_batch(25, developer=self.developer)
+        WorkLogFactory.create_batch(3)
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode("utf-8")
+
+    def test_csv_export_streams_every_scoped_row(self):
+        with self.assertNumQueries(1):
+            content = self.export("/api/projects/worklogs/export/")
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0][:3], ["id", "date_logged", "developer_id"])
+        self.assertEqual(len(rows), 26)
+        self.assertEqual({row[2] for row in rows[1:]}, {str(self.developer.id)})
+
+    def test_ndjson_export_applies_filters(self):
+        status_filter = {"status": WorkLog.Status.APPROVED}
+        WorkLog.objects.filter(
+            id__in=WorkLog.objects.filter(developer=self.developer).values("id")[:4]
+        ).update(**status_filter)
+        content = self.export(
+            "/api/projects/worklogs/export/", file_format="ndjson", **status_filter
+        )
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({row["status"] for row in rows}, {"approved"})
+
+    def test_project_and_invoice_exports(self):
+        self.client.force_authenticate(user=UserFactory(role=User.Role.ADMIN))
+        Invoice.objects.create(amount=10)
+        projects = self.export("/api/projects/projects/export/")
+        self.assertEqual(len(projects.splitlines()), Project.objects.count() + 1)
+        invoices = self.export("/api/projects/invoices/export/", file_format="ndjson")
+        self.assertEqual(json.loads(invoices)["amount"], "10.00")
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get("/api/projects/worklogs/export/?file_format=xls")
+        self.assertEqual(response.status_code, 400)
+
+
+class KeysetPaginationTests(APITestCase):
+    url = "/api/projects/worklogs/"
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client.force_authenticate(user=UserFactory(role=User.Role.ADMIN))
+        work_logs = WorkLogFactory.create_batch(25)
+        for index, work_log in enumerate(work_logs):
+            WorkLog.objects.filter(id=work_log.id).update(
+                date_logged=date(2024, 1, 1 + index % 3)
+            )
+
+    def test_pages_follow_date_and_id_without_counting(self):
+        expected = list(
+            WorkLog.objects.order_by("-date_logged", "-id").values_list("id", flat=True)
+        )
+        seen = []
+        url = f"{self.url}?cursor=&page_size=10"
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn("count", response.data)
+                seen.extend(row["id"] for row in response.data["results"])
+                url = response.data["next"]
+
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(queries), 3)
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f"{self.url}?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_numbers_remain_the_default(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["count"], 25)
+
+
+@skipUnless(connection.vendor == "sqlite", "Plans are checked with SQLite's EXPLAIN")
+class IndexUsageTests(APITestCase):
+    """
+    The hot queries of tasks.py and viewsets.py search indexes instead of
+    scanning tables.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        WorkLogFactory.create_batch(60)
+        Invoice.objects.bulk_create(
+            Invoice(client=UserFactory(role=User.Role.CLIENT), amount=1)
+            for _ in range(20)
+        )
+        self.developer = WorkLog.objects.first().developer
+        self.client_user = Project.objects.first().client
+
+    def scoped(self, viewset, user, params=None):
+        view = viewset()
+        view.request = SimpleNamespace(user=user, query_params=params or {})
+        return view.get_queryset()
+
+    def assertUsesIndex(self, queryset, index=None):
+        plan = queryset.explain()
+        self.assertNotIn("SCAN project_management", plan)
+        if index:
+            self.assertIn(f"USING INDEX {index}", plan)
+
+    def test_billing_queries(self):
+        period = {"start_date": date(2024, 1, 1), "end_date": date(2024, 1, 31)}
+        self.assertUsesIndex(
+            billable_worklogs(client_id=self.client_user.id, **period),
+            "worklog_billing_idx",
+        )
+        self.assertUsesIndex(
+            clients_with_billable_worklogs(**period), "worklog_billing_idx"
+        )
+
+    def test_worklog_queries(self):
+        self.assertUsesIndex(
+            self.scoped(WorkLogViewSet, self.developer).order_by("-date_logged", "-id"),
+            "worklog_dev_date_idx",
+        )
+        self.assertUsesIndex(self.scoped(WorkLogViewSet, self.client_user))
+        self.assertUsesIndex(
+            WorkLogFilter(
+                {"status": WorkLog.Status.REVIEW}, queryset=WorkLog.objects.all()
+            ).qs,
+            "worklog_status_idx",
+        )
+        self.assertUsesIndex(
+            WorkLogFilter(
+                {"project": Project.objects.first().id},
+                queryset=WorkLog.objects.all(),
+            ).qs
+        )
+
+    def test_invoice_and_project_queries(self):
+        self.assertUsesIndex(
+            self.scoped(InvoiceViewSet, self.client_user).order_by(
+                "-generated_date", "-id"
+            ),
+            "invoice_client_date_idx",
+        )
+        self.assertUsesIndex(self.scoped(ProjectViewSet, self.client_user))
+        self.assertUsesIndex(self.scoped(ProjectViewSet, self.developer))
+        self.assertUsesIndex(self.scoped(FeatureViewSet, self.developer))
+
+
+class MembershipTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.project = ProjectFactory(developers=[self.developer])
+        self.other_project = ProjectFactory()
+
+    def test_membership_is_cached_and_memoized(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(visible_project_ids(self.developer), {self.project.id})
+        with self.assertNumQueries(0):
+            visible_project_ids(self.developer)
+        self.assertIsNone(visible_project_ids(UserFactory(role=User.Role.ADMIN)))
+
+    def test_developer_changes_invalidate_membership(self):
+        visible_project_ids(self.developer)
+        self.other_project.developers.add(self.developer)
+        self.assertEqual(
+            visible_project_ids(self.developer),
+            {self.project.id, self.other_project.id},
+        )
+        self.developer.developer_projects.remove(self.project)
+        self.assertEqual(visible_project_ids(self.developer), {self.other_project.id})
+        self.other_project.developers.clear()
+        self.assertEqual(visible_project_ids(self.developer), set())
+
+    def test_client_changes_invalidate_membership(self):
+        client_user = self.project.client
+        new_client = UserFactory(role=User.Role.CLIENT)
+        self.assertEqual(visible_project_ids(client_user), {self.project.id})
+        visible_project_ids(new_client)
+
+        self.project.client = new_client
+        self.project.save()
+        self.assertEqual(visible_project_ids(client_user), set())
+        self.assertEqual(visible_project_ids(new_client), {self.project.id})
+
+    def test_scoped_endpoints(self):
+        self.client.force_authenticate(user=self.developer)
+        response = self.client.get("/api/projects/projects/")
+        self.assertEqual(
+            [row["id"] for row in response.data["results"]], [self.project.id]
+        )
+
+        function = FunctionFactory(feature=FeatureFactory(project=self.project))
+        invoice = Invoice.objects.create(amount=10)
+        WorkLogFactory(function=function, invoice=invoice)
+        Invoice.objects.create(amount=20)
+        response = self.client.get("/api/projects/invoices/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["id"] for row in response.data["results"]], [invoice.id])
+
+
+class ResponseCacheTests(APITestCase):
+    url = "/api/projects/projects/"
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.project = ProjectFactory(developers=[self.developer])
+        self.client.force_authenticate(user=self.developer)
+
+    def titles(self):
+        return [row["title"] for row in self.client.get(self.url).data["results"]]
+
+    def test_repeated_polls_skip_the_database(self):
+        first = self.client.get(self.url).data
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).data, first)
+
+    def test_writes_invalidate_cached_lists(self):
+        self.assertEqual(self.titles(), [self.project.title])
+
+        self.project.title = "Renamed"
+        self.project.save()
+        self.assertEqual(self.titles(), ["Renamed"])
+
+        other = ProjectFactory(title="Other")
+        self.developer.developer_projects.add(other)
+        self.assertEqual(sorted(self.titles()), ["Other", "Renamed"])
+
+    def test_rollup_updates_invalidate_cached_lists(self):
+        ProjectRateFactory(project=self.project, developer=self.developer, rate=10)
+        self.client.get(self.url)
+        FunctionFactory(
+            feature=FeatureFactory(project=self.project),
+            developer=self.developer,
+            estimated_time=2,
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["results"][0]["total_cost"], "20.00")
+
+    def test_versioned_models_are_registered_at_startup(self):
+        for viewset in (
+            ProjectViewSet,
+            FeatureViewSet,
+            FunctionViewSet,
+            WorkLogViewSet,
+            InvoiceViewSet,
+        ):
+            with self.subTest(viewset=viewset.__name__):
+                request = SimpleNamespace(query_params={})
+                viewset(action="list", request=request).get_model_versions()
+
+        view = ProjectViewSet(action="list", request=SimpleNamespace(query_params={}))
+        view.cache_models = [ProjectRate]
+        with self.assertRaises(ImproperlyConfigured):
+            view.get_model_versions()
+
+    def test_cache_is_per_user(self):
+        self.client.get(self.url)
+        self.client.force_authenticate(user=UserFactory(role=User.Role.DEVELOPER))
+        self.assertEqual(self.titles(), [])
+
+
+class ConditionalGetTests(APITestCase):
+    url = "/api/projects/worklogs/"
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.function = FunctionFactory(developer=self.developer, estimated_time=10)
+        self.work_log = WorkLogFactory(
+            developer=self.developer, function=self.function, hours_worked=1
+        )
+        self.client.force_authenticate(user=self.developer)
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.work_log.hours_worked = 2
+        self.work_log.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_bulk_updates_change_the_etag(self):
+        self.work_log.status = WorkLog.Status.REVIEW
+        self.work_log.save()
+        etag = self.client.get(self.url)["ETag"]
+        review_work_logs(
+            work_logs=WorkLog.objects.all(),
+            decision=WorkLog.Status.APPROVED,
+            reason="",
+            reviewer=UserFactory(role=User.Role.ADMIN),
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def set_versions(self, issued):
+        for label in response_cache._versioned_labels:
+            cache.set(response_cache._version_key(label), f"{issued:.6f}:test", None)
+
+    def test_if_modified_since(self):
+        self.set_versions(time.time() - 60)
+        last_modified = self.client.get(self.url)["Last-Modified"]
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        self.work_log.hours_worked = 2
+        self.work_log.save()
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_last_modified_waits_for_the_second_to_pass(self):
+        # A version issued in the current second could be followed by a
+        # write in the same second, which If-Modified-Since cannot tell apart.
+        self.set_versions(time.time() + 5)
+        response = self.client.get(self.url)
+        self.assertNotIn("Last-Modified", response)
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        self.assertEqual(
+            [error.id for error in check_shared_cache(None)], ["core.E001"]
+        )
+        redis = {"BACKEND": "django.core.cache.backends.redis.RedisCache"}
+        with override_settings(CACHES={"default": redis}):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_retrieve_is_conditional_and_scoped(self):
+        url = f"{self.url}{self.work_log.id}/"
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_authenticate(user=UserFactory(role=User.Role.DEVELOPER))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+
+
+class SparseFieldsTests(APITestCase):
+    url = "/api/projects/projects/"
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client.force_authenticate(user=UserFactory(role=User.Role.ADMIN))
+        self.project = ProjectFactory()
+        FeatureFactory.create_batch(2, project=self.project)
+
+    def test_fields_trim_the_response_and_the_select(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"fields": "id,title"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data["results"][0]), {"id", "title"})
+        self.assertFalse(any("description" in query["sql"] for query in queries))
+
+    def test_expansions_cost_constant_queries(self):
+        params = {"expand": "client,developers,features"}
+        with CaptureQueriesContext(connection) as one_project:
+            response = self.client.get(self.url, params)
+        row = response.data["results"][0]
+        self.assertEqual(row["client"]["id"], self.project.client_id)
+        self.assertEqual(len(row["developers"]), 2)
+        self.assertNotIn("password", row["developers"][0])
+        self.assertEqual(len(row["features"]), 2)
+
+        for project in ProjectFactory.create_batch(3):
+            FeatureFactory.create_batch(2, project=project)
+        cache.clear()
+        with self.assertNumQueries(len(one_project)):
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.data["count"], 4)
+
+    def test_related_ids_are_prefetched_without_expansion(self):
+        ProjectFactory.create_batch(3)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        cache.clear()
+        ProjectFactory.create_batch(3)
+        with self.assertNumQueries(len(queries)):
+            self.client.get(self.url)
+
+    def test_logins_keep_cached_expansions(self):
+        params = {"expand": "client"}
+        etag = self.client.get(self.url, params)["ETag"]
+        client = self.project.client
+        client.last_login = timezone.now()
+        client.save(update_fields=["last_login"])
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        client.first_name = "Renamed"
+        client.save(update_fields=["first_name"])
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][0]["client"]["first_name"], "Renamed")
+
+    def test_only_expansions_depend_on_the_models_they_inline(self):
+        url = "/api/projects/features/"
+        function = FunctionFactory(
+            feature=self.project.features.first(), estimated_time=10
+        )
+        self.client.get(url)
+        self.client.get(url, {"expand": "functions"})
+        # Logging hours only changes the function, not the feature rollups.
+        WorkLogFactory(function=function, hours_worked=2)
+
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        response = self.client.get(url, {"expand": "functions"})
+        logged = [
+            function["logged_hours"]
+            for row in response.data["results"]
+            for function in row["functions"]
+        ]
+        self.assertEqual(logged, ["2.00"])
+
+    def test_nested_expansion_on_features(self):
+        response = self.client.get(
+            "/api/projects/features/", {"expand": "project", "fields": "id"}
+        )
+        row = response.data["results"][0]
+        self.assertEqual(set(row), {"id", "project"})
+        self.assertEqual(row["project"]["id"], self.project.id)
+
+    def test_unknown_names_are_rejected(self):
+        response = self.client.get(self.url, {"expand": "invoices"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.url, {"fields": "id,budget"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProjectTreeTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.developer = UserFactory(role=User.Role.DEVELOPER)
+        self.project = ProjectFactory(developers=[self.developer])
+        ProjectRateFactory(project=self.project, developer=self.developer, rate=10)
+        self.url = f"/api/projects/projects/{self.project.id}/tree/"
+        self.client.force_authenticate(user=UserFactory(role=User.Role.ADMIN))
+
+    def add_feature(self, functions):
+        feature = FeatureFactory(project=self.project)
+        for status in functions:
+            function = FunctionFactory(
+                feature=feature,
+                developer=self.developer,
+                estimated_time=4,
+                status=status,
+            )
+            WorkLogFactory(
+                function=function, developer=self.developer, hours_worked=1.5
+            )
+        return feature
+
+    def test_tree_has_rollups_and_status_counts(self):
+        feature = self.add_feature(
+            [
+                Function.Status.BACKLOG,
+                Function.Status.COMPLETED,
+                Function.Status.BACKLOG,
+            ]
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["total_cost"], "120.00")
+
+        (row,) = response.data["features"]
+        self.assertEqual(row["id"], feature.id)
+        self.assertEqual(row["logged_hours"], "4.50")
+        self.assertEqual(row["function_status_counts"][Function.Status.BACKLOG], 2)
+        self.assertEqual(row["function_status_counts"][Function.Status.COMPLETED], 1)
+        self.assertEqual(row["function_status_counts"][Function.Status.BLOCKED], 0)
+        self.assertEqual(
+            [function["logged_hours"] for function in row["functions"]],
+            ["1.50", "1.50", "1.50"],
+        )
+        self.assertEqual(row["functions"][0]["cost"], "40.00")
+
+    def test_tree_costs_constant_queries(self):
+        self.add_feature([Function.Status.BACKLOG])
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+        for _ in range(3):
+            self.add_feature([Function.Status.BACKLOG] * 3)
+        cache.clear()
+        with self.assertNumQueries(len(small)):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data["features"]), 4)
+        self.assertLessEqual(len(small), 3)
+
+    def test_worklogs_refresh_the_tree_but_not_the_project_list(self):
+        function = self.add_feature([Function.Status.BACKLOG]).functions.get()
+        self.client.get("/api/projects/projects/")
+        etag = self.client.get(self.url)["ETag"]
+
+        WorkLogFactory(function=function, developer=self.developer, hours_worked=1)
+
+        with self.assertNumQueries(0):
+            self.client.get("/api/projects/projects/")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["features"][0]["logged_hours"], "2.50")
+
+    def test_tree_is_scoped_and_conditional(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.add_feature([Function.Status.BACKLOG])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_authenticate(user=UserFactory(role=User.Role.DEVELOPER))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_functions_are_routed(self):
+        self.add_feature([Function.Status.BACKLOG])
+        response = self.client.get("/api/projects/functions/", {"expand": "feature"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 1)
+        self.client.force_authenticate(user=self.developer)
+        response = self.client.post("/api/projects/functions/", {})
+        self.assertEqual(response.status_code, 405)
@@ -0,0 +1,212 @@
+"""
+Bulk worklog writes for timesheet submission and review, and the
+timesheet rollup of hours by developer, project and period.
+"""
+
+import hashlib
+import json
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from simple_history.utils import bulk_create_with_history
+
+from core.response_cache import invalidate_model
+from project_management.models import Function, WorkLog
+
+BULK_BATCH_SIZE = 500
+
+TIMESHEET_CACHE_TIMEOUT = 15 * 60
+
+TIMESHEET_VERSION_KEY = "timesheet-version"
+
+TIMESHEET_PERIODS = {"week": TruncWeek, "month": TruncMonth}
+
+
+def _add_logged_hours(hours_by_function):
+    if not hours_by_function:
+        return
+    field = Function._meta.get_field("logged_hours")
+    Function.objects.filter(id__in=hours_by_function).update(
+        logged_hours=F("logged_hours")
+        + Case(
+            *(
+                When(id=function_id, then=Value(hours))
+                for function_id, hours in hours_by_function.items()
+            ),
+            output_field=field,
+        )
+    )
+
+
+def bulk_log_work(*, developer, entries):
+    """
+    Create a developer's worklogs for many entries in one transaction.
+
+    `entries` are dicts with `function` (an id), `hours_worked` and
+    `description`. The functions are locked and loaded in one query and
+    every entry is checked against its function's remaining budget,
+    counting the entries before it. Nothing is written unless every entry
+    passes; otherwise ValidationError maps the index of each failing entry
+    to its errors, the same shape DRF uses for nested list fields.
+    """
+    with transaction.atomic():
+        functions = (
+            Function.objects.select_for_update()
+            .only("id", "estimated_time", "logged_hours")
+            .in_bulk({entry["function"] for entry in entries})
+        )
+        logged = {
+            function_id: function.logged_hours
+            for function_id, function in functions.items()
+        }
+        hours_by_function = {}
+        errors = {}
+        for index, entry in enumerate(entries):
+            function = functions.get(entry["function"])
+            if function is None:
+                errors[index] = {"function": ["Function does not exist"]}
+                continue
+            if (
+                function.estimated_time is not None
+                and logged[function.id] >= function.estimated_time
+            ):
+                errors[index] = {"function": ["Function has already been completed"]}
+                continue
+            logged[function.id] += entry["hours_worked"]
+            hours_by_function[function.id] = (
+                hours_by_function.get(function.id, 0) + entry["hours_worked"]
+            )
+        if errors:
+            raise ValidationError({"entries": errors})
+
+        work_logs = bulk_create_with_history(
+            [
+                WorkLog(
+                    function_id=entry["function"],
+                    developer=developer,
+                    hours_worked=entry["hours_worked"],
+                    description=entry["description"],
+                    status=WorkLog.Status.REVIEW,
+                )
+                for entry in entries
+            ],
+            WorkLog,
+            batch_size=BULK_BATCH_SIZE,
+            default_user=developer,
+        )
+        _add_logged_hours(hours_by_function)
+        invalidate_model(WorkLog)
+        invalidate_model(Function)
+        invalidate_timesheets()
+    return work_logs
+
+
+def review_work_logs(*, work_logs, decision, reason, reviewer):
+    """
+    Approve or reject every worklog of `work_logs` still awaiting review.
+
+    The rows are locked and loaded once, changed with one UPDATE and get
+    one history row each, created in bulk. Returns the number of reviewed
+    worklogs.
+    """
+    with transaction.atomic():
+        pending = list(
+            work_logs.filter(status=WorkLog.Status.REVIEW)
+            .select_for_update(of=("self",))
+            .order_by()
+        )
+        if not pending:
+            return 0
+        WorkLog.objects.filter(id__in=[work_log.id for work_log in pending]).update(
+            status=decision, reason=reason
+        )
+        for work_log in pending:
+            work_log.status = decision
+            work_log.reason = reason
+        WorkLog.history.bulk_history_create(
+            pending,
+            batch_size=BULK_BATCH_SIZE,
+            update=True,
+            default_user=reviewer,
+            default_date=timezone.now(),
+        )
+        invalidate_model(WorkLog)
+        invalidate_timesheets()
+    return len(pending)
+
+
+def _breakdown(choices, field):
+    return {
+        f"{field}_{value}": Sum("hours_worked", filter=Q(**{field: value}))
+        for value in choices.values
+    }
+
+
+def timesheet_rows(work_logs, *, period="week"):
+    """
+    Hours of `work_logs` per developer, project and week or month.
+
+    One grouped query computes the total and the split by review status
+    and billing status; weeks start on Monday, as in ISO 8601.
+    """
+    from project_management.billing import _developer_name
+
+    breakdowns = {
+        **_breakdown(WorkLog.Status, "status"),
+        **_breakdown(WorkLog.BillingStatus, "billed_status"),
+    }
+    rows = (
+        work_logs.values(
+            "developer_id",
+            period=TIMESHEET_PERIODS[period]("date_logged"),
+            project_id=F("function__feature__project_id"),
+            project_title=F("function__feature__project__title"),
+            developer_name=_developer_name(),
+        )
+        .annotate(hours=Sum("hours_worked"), **breakdowns)
+        .order_by("period", "project_title", "developer_name")
+    )
+    for row in rows:
+        for field, choices in (
+            ("status", WorkLog.Status),
+            ("billed_status", WorkLog.BillingStatus),
+        ):
+            row[field] = {
+                value: row.pop(f"{field}_{value}") or 0 for value in choices.values
+            }
+        yield row
+
+
+def _timesheet_version():
+    version = cache.get(TIMESHEET_VERSION_KEY)
+    if version is None:
+        cache.add(TIMESHEET_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(TIMESHEET_VERSION_KEY)
+    return version
+
+
+def timesheet_cache_key(*, scope, params):
+    """
+    Cache key for a timesheet of `scope` with the given query parameters.
+
+    Keys embed the current timesheet version, so `invalidate_timesheets`
+    retires every cached timesheet at once.
+    """
+    digest = hashlib.sha256(
+        json.dumps(sorted(params.items())).encode("utf-8")
+    ).hexdigest()
+    return f"timesheet:{_timesheet_version()}:{scope}:{digest}"
+
+
+def invalidate_timesheets():
+    def bump():
+        cache.set(TIMESHEET_VERSION_KEY, uuid.uuid4().hex, None)
+
+    bump()
+    # A concurrent reader may cache the old rows before this commits.
+    transaction.on_commit(bump)
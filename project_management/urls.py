@@ -3,7 +3,10 @@ from rest_framework.routers import DefaultRouter
 
 from project_management.views import InvoiceView, generate_invoice
 from project_management.viewsets import (
+    BillingRunViewSet,
     FeatureViewSet,
+    FunctionViewSet,
+    InvoiceJobViewSet,
     InvoiceViewSet,
     ProjectRateViewSet,
     ProjectViewSet,
@@ -15,7 +18,10 @@ router.register(r"projects", ProjectViewSet)
 router.register(r"worklogs", WorkLogViewSet)
 router.register(r"invoices", InvoiceViewSet)
 router.register(r"features", FeatureViewSet)
+router.register(r"functions", FunctionViewSet)
 router.register(r"project-rates", ProjectRateViewSet)
+router.register(r"billing-runs", BillingRunViewSet)
+router.register(r"invoice-jobs", InvoiceJobViewSet)
 urlpatterns = [
     *router.urls,
     path("generate_invoice/", generate_invoice),
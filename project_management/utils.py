@@ -6,9 +6,9 @@ def generate_financial_data_for_client(project, user):
 
 
 def get_developer_rate(*, project, developer):
-    from project_management.models import ProjectRate
+    from project_management.rates import get_rate
 
-    project_rate = ProjectRate.objects.filter(project=project, developer=developer)
-    if not project_rate.exists():
-        return 0
-    return project_rate.first().rate
+    return get_rate(
+        project_id=project and project.pk,
+        developer_id=developer and developer.pk,
+    )
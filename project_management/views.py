@@ -2,7 +2,6 @@ import base64
 import os
 from datetime import datetime
 
-import pdfkit
 from django.conf import settings
 from django.contrib.staticfiles import finders
 from django.http import HttpResponse
@@ -14,8 +13,12 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from project_management.serializers import GenerateInvoiceSerializer
-from project_management.tasks import generate_invoice_task
+from project_management.rendering import render_pdf
+from project_management.serializers import (
+    GenerateInvoiceSerializer,
+    InvoiceJobSerializer,
+)
+from project_management.tasks import queue_invoice_job
 
 
 class InvoiceView(APIView):
@@ -59,24 +62,8 @@ class InvoiceView(APIView):
             },
         )
 
-        # Configure pdfkit options
-        options = {
-            "page-size": "A4",
-            "encoding": "UTF-8",
-        }
-
-        # Path to wkhtmltopdf executable
-        # If wkhtmltopdf is in PATH, you can omit configuration
-        # Otherwise, specify the path like:
-        # config = pdfkit.configuration(wkhtmltopdf='/usr/local/bin/wkhtmltopdf')
-        config = None
-        # Example for Windows:
-        # config = pdfkit.configuration(wkhtmltopdf=r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe')
-
-        # Generate PDF
-        pdf = pdfkit.from_string(
-            html_string, False, options=options, configuration=config
-        )
+        # Generate PDF with the configured backend (see PDF_RENDERER)
+        pdf = render_pdf(html_string)
 
         # Create HTTP response with PDF
         response = HttpResponse(pdf, content_type="application/pdf")
@@ -97,8 +84,16 @@ def generate_invoice(request):
     end_date = serializer.validated_data["end_date"]
     client = serializer.validated_data["client"]
 
-    generate_invoice_task.delay(start_date, end_date, client.id)
-    return Response(serializer.data, status=status.HTTP_201_CREATED)
+    job, created = queue_invoice_job(
+        requested_by=request.user,
+        client=client,
+        start_date=start_date,
+        end_date=end_date,
+    )
+    return Response(
+        InvoiceJobSerializer(job).data,
+        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+    )
 
 
 class FinanceView(APIView):
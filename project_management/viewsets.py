@@ -1,9 +1,21 @@
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, Prefetch, Sum, prefetch_related_objects
+from django.db.models.functions import Coalesce
 from rest_framework import status, viewsets
-from rest_framework.exceptions import MethodNotAllowed, PermissionDenied
+from rest_framework.decorators import action
+from rest_framework.exceptions import (
+    MethodNotAllowed,
+    NotFound,
+    PermissionDenied,
+    ValidationError,
+)
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from core.downloads import serve_file
+from core.exports import ExportMixin
 from core.permissions import (
     IsAdmin,
     IsAdminOrClient,
@@ -11,31 +23,80 @@ from core.permissions import (
     IsAdminOrDeveloper,
     IsDeveloper,
 )
+from core.response_cache import CachedListMixin, ConditionalGetMixin
+from core.sparse_fields import SparseFieldsViewMixin
+from project_management.billing import (
+    billable_worklogs,
+    grand_total,
+    line_items,
+    project_subtotals,
+)
 from project_management.filters import WorkLogFilter
+from project_management.membership import scope_to_projects
 from project_management.models import (
+    BillingRun,
     Feature,
     Function,
     Invoice,
+    InvoiceJob,
     Project,
     ProjectRate,
     WorkLog,
 )
 from project_management.serializers import (
+    BillingRunSerializer,
     ClientFeatureUpdateSerializer,
     FeatureSerializer,
     FunctionSerializer,
+    InvoiceJobSerializer,
+    InvoicePreviewRequestSerializer,
+    InvoicePreviewSerializer,
     InvoiceSerializer,
     ProjectRateSerializer,
     ProjectSerializer,
+    ProjectTreeSerializer,
+    TimesheetRequestSerializer,
+    TimesheetRowSerializer,
+    WorkLogBulkCreateSerializer,
+    WorkLogBulkReviewSerializer,
     WorkLogCreateSerializer,
     WorkLogListSerializer,
 )
+from project_management.tasks import dispatch_billing_run_task
+from project_management.timesheets import (
+    TIMESHEET_CACHE_TIMEOUT,
+    bulk_log_work,
+    review_work_logs,
+    timesheet_cache_key,
+    timesheet_rows,
+)
 
 User = get_user_model()
 
 
-class ProjectViewSet(viewsets.ModelViewSet):
+class ProjectViewSet(
+    SparseFieldsViewMixin,
+    ConditionalGetMixin,
+    CachedListMixin,
+    ExportMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Project.objects.all()
+    # Inlined members are invalidated through Project (see
+    # project_management.signals).
+    cache_models = [Project.developers.through]
+    expand_cache_models = {"features": [Feature]}
+    export_fields = [
+        "id",
+        "title",
+        "status",
+        "priority",
+        "start_date",
+        "end_date",
+        "client_id",
+        "total_cost",
+        "total_estimated_time",
+    ]
     search_fields = ["title", "description"]
     ordering_fields = ["start_date", "end_date", "priority", "status"]
     filterset_fields = {
@@ -62,16 +123,47 @@ class ProjectViewSet(viewsets.ModelViewSet):
         return ProjectSerializer
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == User.Role.CLIENT:
-            return Project.objects.filter(client=user)
-        elif user.role == User.Role.DEVELOPER:
-            return Project.objects.filter(developers__in=[user])
-        return Project.objects.all()
+        return scope_to_projects(Project.objects.all(), self.request.user, "id")
+
+    def get_cache_models(self):
+        models = super().get_cache_models()
+        if self.action == "tree":
+            models += [Feature, Function]
+        return models
+
+    @action(detail=True, methods=["get"])
+    def tree(self, request, pk=None):
+        """
+        The project with its features and their functions, loaded with one
+        query per level. Each feature carries the hours logged on its
+        functions and how many of them are in each status.
+        """
+        project = self.get_object()
+        features = (
+            Feature.objects.annotate(
+                logged_hours=Coalesce(
+                    Sum("functions__logged_hours"), 0, output_field=DecimalField()
+                )
+            )
+            .prefetch_related(
+                Prefetch("functions", queryset=Function.objects.order_by("id"))
+            )
+            .order_by("id")
+        )
+
+        def render():
+            prefetch_related_objects([project], Prefetch("features", queryset=features))
+            return Response(ProjectTreeSerializer(project).data)
 
+        return self.conditional_response(request, render)
 
-class FeatureViewSet(viewsets.ModelViewSet):
+
+class FeatureViewSet(
+    SparseFieldsViewMixin, ConditionalGetMixin, CachedListMixin, viewsets.ModelViewSet
+):
     queryset = Feature.objects.all()
+    cache_models = [Project, Project.developers.through]
+    expand_cache_models = {"functions": [Function]}
     serializer_class = FeatureSerializer
     search_fields = ["title", "description"]
     ordering_fields = ["status"]
@@ -82,35 +174,52 @@ class FeatureViewSet(viewsets.ModelViewSet):
         return FeatureSerializer
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == User.Role.CLIENT:
-            return Feature.objects.filter(project__client=user)
-        elif user.role == User.Role.DEVELOPER:
-            return Feature.objects.filter(project__developers__in=[user])
-        return Feature.objects.all()
+        return scope_to_projects(Feature.objects.all(), self.request.user)
 
 
-class FunctionViewSet(viewsets.ModelViewSet):
+class FunctionViewSet(
+    SparseFieldsViewMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet
+):
+    # Read-only; functions are still created and edited in the admin.
     queryset = Function.objects.all()
+    cache_models = [Project, Project.developers.through]
+    expand_cache_models = {"feature": [Feature]}
     serializer_class = FunctionSerializer
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == User.Role.CLIENT:
-            return Function.objects.filter(feature__project__client=user)
-        elif user.role == User.Role.DEVELOPER:
-            return Function.objects.filter(feature__project__developers__in=[user])
-        return Function.objects.all()
+        return scope_to_projects(
+            Function.objects.order_by("id"), self.request.user, "feature__project_id"
+        )
 
 
-class WorkLogViewSet(viewsets.ModelViewSet):
+class WorkLogViewSet(ConditionalGetMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = WorkLog.objects.all()
+    cache_models = [Project, Project.developers.through]
     filterset_class = WorkLogFilter
+    keyset_ordering = ("-date_logged", "-id")
+    export_fields = [
+        "id",
+        "date_logged",
+        "developer_id",
+        "developer__username",
+        "function__feature__project_id",
+        "function_id",
+        "function__title",
+        "hours_worked",
+        "status",
+        "billed_status",
+        "invoice_id",
+        "description",
+    ]
 
     permission_mappings = {
         "list": [IsAdminOrClientOrDeveloper],
         "retrieve": [IsAdminOrClientOrDeveloper],
+        "timesheet": [IsAdminOrClientOrDeveloper],
+        "export": [IsAdminOrClientOrDeveloper],
         "create": [IsDeveloper],
+        "bulk_create": [IsDeveloper],
+        "bulk_review": [IsAdmin],
         "update": [IsAdminOrDeveloper],
         "partial_update": [IsAdminOrDeveloper],
     }
@@ -120,7 +229,9 @@ class WorkLogViewSet(viewsets.ModelViewSet):
         if user.role == User.Role.DEVELOPER:
             return WorkLog.objects.filter(developer=user)
         if user.role == User.Role.CLIENT:
-            return WorkLog.objects.filter(function__feature__project__client=user)
+            return scope_to_projects(
+                WorkLog.objects.all(), user, "function__feature__project_id"
+            )
         return WorkLog.objects.all()
 
     def get_serializer_class(self):
@@ -136,11 +247,106 @@ class WorkLogViewSet(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         raise MethodNotAllowed("DELETE")
 
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk_create(self, request):
+        """
+        Log many entries at once, e.g. a week of timesheet rows.
+        """
+        serializer = WorkLogBulkCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        work_logs = bulk_log_work(
+            developer=request.user,
+            entries=serializer.validated_data["entries"],
+        )
+        return Response(
+            WorkLogListSerializer(work_logs, many=True).data,
+            status=status.HTTP_201_CREATED,
+        )
 
-class InvoiceViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=["post"], url_path="bulk-review")
+    def bulk_review(self, request):
+        """
+        Approve or reject worklogs awaiting review, picked by id or by the
+        same filters as the list endpoint.
+        """
+        serializer = WorkLogBulkReviewSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        work_logs = self.get_queryset()
+        if "ids" in data:
+            work_logs = work_logs.filter(id__in=data["ids"])
+        else:
+            filterset = WorkLogFilter(data["filter"], queryset=work_logs)
+            if not filterset.is_valid():
+                raise ValidationError({"filter": filterset.errors})
+            work_logs = filterset.qs
+
+        reviewed = review_work_logs(
+            work_logs=work_logs,
+            decision=data["decision"],
+            reason=data.get("reason"),
+            reviewer=request.user,
+        )
+        response = {"decision": data["decision"], "reviewed": reviewed}
+        if "ids" in data:
+            response["skipped"] = len(set(data["ids"])) - reviewed
+        return Response(response)
+
+    @action(detail=False, methods=["get"])
+    def timesheet(self, request):
+        """
+        Hours per developer, project and week or month, split by review and
+        billing status. Accepts the list filters plus `period`, `start_date`
+        and `end_date`.
+        """
+        serializer = TimesheetRequestSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        user = request.user
+        scope = "admin" if user.role == User.Role.ADMIN else f"{user.role}:{user.id}"
+        key = timesheet_cache_key(
+            scope=scope,
+            params={
+                name: request.query_params.getlist(name)
+                for name in request.query_params
+            },
+        )
+        data = cache.get(key)
+        if data is None:
+            filterset = WorkLogFilter(
+                request.query_params, queryset=self.get_queryset()
+            )
+            if not filterset.is_valid():
+                raise ValidationError(filterset.errors)
+            work_logs = filterset.qs
+            if "start_date" in params:
+                work_logs = work_logs.filter(date_logged__gte=params["start_date"])
+            if "end_date" in params:
+                work_logs = work_logs.filter(date_logged__lte=params["end_date"])
+            data = TimesheetRowSerializer(
+                timesheet_rows(work_logs, period=params["period"]), many=True
+            ).data
+            cache.set(key, data, TIMESHEET_CACHE_TIMEOUT)
+        return Response(data)
+
+
+class InvoiceViewSet(ConditionalGetMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Invoice.objects.all()
+    cache_models = [WorkLog, Project, Project.developers.through]
     http_method_names = ["get"]
     serializer_class = InvoiceSerializer
+    keyset_ordering = ("-generated_date", "-id")
+    export_fields = [
+        "id",
+        "client_id",
+        "amount",
+        "status",
+        "from_date",
+        "to_date",
+        "generated_date",
+    ]
 
     def get_queryset(self):
         user = self.request.user
@@ -149,11 +355,56 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         if user.role == User.Role.CLIENT:
             return Invoice.objects.filter(client=user)
         if user.role == User.Role.DEVELOPER:
-            return Invoice.objects.filter(
-                function__feature__project__developers__in=[user]
+            worklogs = scope_to_projects(
+                WorkLog.objects.filter(invoice__isnull=False),
+                user,
+                "function__feature__project_id",
             )
+            return Invoice.objects.filter(id__in=worklogs.values("invoice_id"))
         return Invoice.objects.none()
 
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        invoice = self.get_object()
+        if not invoice.pdf_file:
+            raise NotFound("The PDF for this invoice has not been generated yet")
+        return serve_file(
+            request,
+            invoice.pdf_file,
+            filename=f"invoice_{invoice.id}.pdf",
+            content_type="application/pdf",
+        )
+
+    @action(detail=False, methods=["get"], permission_classes=[IsAdmin])
+    def preview(self, request):
+        """
+        Price a client's unbilled worklogs for a period without invoicing them.
+        """
+        serializer = InvoicePreviewRequestSerializer(
+            data=request.query_params, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+        client = serializer.validated_data["client"]
+        start_date = serializer.validated_data["start_date"]
+        end_date = serializer.validated_data["end_date"]
+
+        worklogs = billable_worklogs(
+            client_id=client.id,
+            start_date=start_date,
+            end_date=end_date,
+        )
+        preview = {
+            "client": client.id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "line_items": line_items(
+                worklogs, detail=serializer.validated_data["detail"]
+            ),
+            "projects": project_subtotals(worklogs),
+            "grand_total": grand_total(worklogs),
+        }
+        return Response(InvoicePreviewSerializer(preview).data)
+
 
 class ProjectRateViewSet(viewsets.ModelViewSet):
     queryset = ProjectRate.objects.all()
@@ -164,3 +415,22 @@ class ProjectRateViewSet(viewsets.ModelViewSet):
         if self.action in ["create", "partial_update", "destroy"]:
             return [IsAdmin()]
         return [IsAuthenticated()]
+
+
+class BillingRunViewSet(viewsets.ModelViewSet):
+    queryset = BillingRun.objects.all().order_by("-created_at")
+    serializer_class = BillingRunSerializer
+    permission_classes = [IsAdmin]
+    filterset_fields = ["status"]
+    http_method_names = ["get", "post"]
+
+    def perform_create(self, serializer):
+        billing_run = serializer.save(requested_by=self.request.user)
+        transaction.on_commit(lambda: dispatch_billing_run_task.delay(billing_run.id))
+
+
+class InvoiceJobViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = InvoiceJob.objects.all().order_by("-created_at")
+    serializer_class = InvoiceJobSerializer
+    permission_classes = [IsAdmin]
+    filterset_fields = ["stage", "client"]